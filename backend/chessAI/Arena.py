@@ -1,4 +1,3 @@
-import numpy as np
 from chessAI.pytorch_classification.utils import Bar, AverageMeter
 import time
 
@@ -41,16 +40,15 @@ class Arena():
                 assert(self.display)
                 print("Turn ", str(it), "Player ", str(curPlayer))
                 self.display(board)
-            action = players[curPlayer+1](self.game.getCanonicalForm(board, curPlayer))
+            canonicalBoard = self.game.getCanonicalForm(board, curPlayer)
+            action = players[curPlayer+1](canonicalBoard)
 
-            valids = self.game.getValidMoves(self.game.getCanonicalForm(board, curPlayer),1)
-            if valids[action]==0:
+            valids = self.game.getValidActions(canonicalBoard,1)
+            if action not in valids:
                 print('\n')
                 print(action)
-                assert valids[action] >0
-            action_vec = np.zeros((4096,))
-            action_vec[action] = 1
-            board, curPlayer = self.game.getNextState(board, curPlayer, action_vec)
+                assert action in valids
+            board, curPlayer = self.game.getNextState(board, curPlayer, action)
             if it > 1000:
                 print('\n draw by move rule \n')
                 return 1e-12
@@ -0,0 +1,559 @@
+from collections.abc import Mapping
+from chessAI.Piece import Piece, DENOMINATIONS, FEN_LETTERS, square_name, parse_square
+from chessAI.Move import Move
+from chessAI.Board import Board, ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT, ZOBRIST_BLACK_TO_MOVE, NO_RECENT_MOVES
+from chessAI.Position import PositionMixin, parse_move_clocks
+import numpy as np
+
+# Squares are numbered row*8+col to match the (row,col) tuples used by Board,
+# so bit 0 is (0,0) (black's queen rook corner) and bit 63 is (7,7).
+# Piece planes are ordered colour-major: white Pawn..King are planes 0-5 and
+# black Pawn..King are planes 6-11 (so a plane is the Piece.code).
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+ORTHOGONAL = [(1,0), (-1,0), (0,1), (0,-1)]
+DIAGONAL = [(1,1), (1,-1), (-1,1), (-1,-1)]
+
+
+def side_index(color):
+    """0 for white (1) and 1 for black (-1)"""
+    return (1 - color)//2
+
+def square_index(position):
+    (row,col) = position
+    return row*8 + col
+
+def square_position(square):
+    return divmod(square, 8)
+
+# (row,col) of each square number, and the Piece of each plane on each square
+POSITIONS = [divmod(square, 8) for square in range(64)]
+PLANE_PIECES = [[Piece(DENOMINATIONS[plane % 6], 1 if plane < 6 else -1, POSITIONS[square]) for square in range(64)]
+    for plane in range(12)]
+
+
+def _step_table(offsets):
+    table = []
+    for square in range(64):
+        (row,col) = divmod(square, 8)
+        mask = 0
+        for (dRow,dCol) in offsets:
+            if (0 <= row+dRow < 8) and (0 <= col+dCol < 8):
+                mask |= 1 << ((row+dRow)*8 + col+dCol)
+        table.append(mask)
+    return table
+
+def _ray_table(direction):
+    (dRow,dCol) = direction
+    table = []
+    for square in range(64):
+        (row,col) = divmod(square, 8)
+        mask = 0
+        row, col = row+dRow, col+dCol
+        while (0 <= row < 8) and (0 <= col < 8):
+            mask |= 1 << (row*8 + col)
+            row, col = row+dRow, col+dCol
+        table.append(mask)
+    return table
+
+KNIGHT_ATTACKS = _step_table([(1,2), (-1,2), (1,-2), (-1,-2), (2,1), (-2,1), (2,-1), (-2,-1)])
+KING_ATTACKS = _step_table(ORTHOGONAL + DIAGONAL)
+# PAWN_ATTACKS[side][square]: squares a pawn of that side standing on square captures
+PAWN_ATTACKS = [_step_table([(-1,1), (-1,-1)]), _step_table([(1,1), (1,-1)])]
+RAYS = dict((direction, _ray_table(direction)) for direction in ORTHOGONAL + DIAGONAL)
+# Rays running towards higher square numbers find their first blocker with the
+# lowest set bit, the others with the highest set bit.
+POSITIVE = dict((direction, direction[0]*8 + direction[1] > 0) for direction in RAYS)
+
+# Castling rights bits: (white left, white right, black left, black right)
+WHITE_LEFT, WHITE_RIGHT, BLACK_LEFT, BLACK_RIGHT = 1, 2, 4, 8
+# Rights lost when a move starts or ends on the given square
+CASTLING_LOSS = dict([(60, WHITE_LEFT | WHITE_RIGHT), (56, WHITE_LEFT), (63, WHITE_RIGHT),
+                      (4, BLACK_LEFT | BLACK_RIGHT), (0, BLACK_LEFT), (7, BLACK_RIGHT)])
+
+# Zobrist keys of Board indexed by plane and square, so that a BitBoard
+# hashes a position to the same key as the equivalent Board, and the keys
+# of the color flipped piece (see Board.mirror)
+PIECE_KEYS = [[ZOBRIST_PIECES[(DENOMINATIONS[plane % 6], 1 if plane < 6 else -1, divmod(square, 8))]
+    for square in range(64)] for plane in range(12)]
+MIRROR_PIECE_KEYS = [[PIECE_KEYS[(plane+6) % 12][square ^ 56] for square in range(64)] for plane in range(12)]
+
+def _castling_key(castling, mirrored):
+    (white,black) = ("whiteCastlingRights","blackCastlingRights")
+    if mirrored:
+        (white,black) = (black,white)
+    key = 0
+    for (bit,rightsKey,side) in ((WHITE_LEFT,white,0), (WHITE_RIGHT,white,1), (BLACK_LEFT,black,0), (BLACK_RIGHT,black,1)):
+        if castling & bit:
+            key ^= ZOBRIST_CASTLING[rightsKey][side]
+    return key
+
+# Keys of each castling bit set, as hashed by the board and by its mirror
+CASTLING_KEYS = [_castling_key(castling, False) for castling in range(16)]
+MIRROR_CASTLING_KEYS = [_castling_key(castling, True) for castling in range(16)]
+
+def _state_keys(castling, enPassant, turn):
+    """Zobrist keys of the castling rights, en passant column and turn, and
+    of the same state seen from the color flipped board"""
+    key = CASTLING_KEYS[castling]
+    mirrorKey = MIRROR_CASTLING_KEYS[castling]
+    if enPassant is not None:
+        key ^= ZOBRIST_EN_PASSANT[enPassant % 8]
+        mirrorKey ^= ZOBRIST_EN_PASSANT[enPassant % 8]
+    if turn == -1:
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    else:
+        mirrorKey ^= ZOBRIST_BLACK_TO_MOVE
+    return (key, mirrorKey)
+
+
+def slider_attacks(square, occupied, directions):
+    """Returns the mask of squares reached from square along the given
+    directions, stopping at (and including) the first occupied square"""
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE[direction]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+def first_square(mask, direction):
+    """Returns the square of the bit of mask met first when walking along
+    direction (mask must lie on one ray of that direction)"""
+    if POSITIVE[direction]:
+        return (mask & -mask).bit_length() - 1
+    return mask.bit_length() - 1
+
+def flip_rows(mask):
+    """Mirrors a mask top to bottom: each row is one byte, so this is a
+    byte swap of the 64-bit integer"""
+    return int.from_bytes(mask.to_bytes(8, "little"), "big")
+
+def squares(mask):
+    """Yields the square numbers of all set bits in mask"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BoardView(Mapping):
+    """Read-only view of a BitBoard as the dict of a Board (see Board.board):
+    (row,col) squares map to the Pieces standing on them, followed by the
+    state keys, so code indexing board.board works on either"""
+    STATE_KEYS = ("whiteCastlingRights", "blackCastlingRights", "whiteKing", "blackKing", "enPassant", "recentMoves", "turn")
+
+    def __init__(self,bitBoard):
+        self.bitBoard = bitBoard
+
+    def __getitem__(self,key):
+        bitBoard = self.bitBoard
+        if isinstance(key, tuple):
+            (row,col) = key
+            piece = bitBoard.piece_at(key) if (0 <= row < 8) and (0 <= col < 8) else None
+            if piece is None:
+                raise KeyError(key)
+            return piece
+        if key == "turn":
+            return bitBoard.turn
+        if key == "whiteCastlingRights":
+            return (bool(bitBoard.castling & WHITE_LEFT), bool(bitBoard.castling & WHITE_RIGHT))
+        if key == "blackCastlingRights":
+            return (bool(bitBoard.castling & BLACK_LEFT), bool(bitBoard.castling & BLACK_RIGHT))
+        if key == "whiteKing":
+            return bitBoard.king_position(1)
+        if key == "blackKing":
+            return bitBoard.king_position(-1)
+        if key == "enPassant":
+            return None if bitBoard.enPassant is None else square_position(bitBoard.enPassant)
+        if key == "recentMoves":
+            return bitBoard.recentMoves
+        raise KeyError(key)
+
+    def __iter__(self):
+        for square in squares(self.bitBoard.occupancy(1) | self.bitBoard.occupancy(-1)):
+            yield square_position(square)
+        for key in self.STATE_KEYS:
+            yield key
+
+    def __len__(self):
+        return bin(self.bitBoard.occupancy(1) | self.bitBoard.occupancy(-1)).count("1") + len(self.STATE_KEYS)
+
+
+class BitBoard(PositionMixin):
+    """This class defines a chess game state stored as twelve 64-bit piece
+    masks. It offers the same interface as Board (board.board is a
+    BoardView) and can be converted to and from it."""
+    def __init__(self,pieces,turn,castling,enPassant,recentMoves,key=None,mirrorKey=None,history=None,halfmoveClock=0,fullmoveNumber=1):
+        """pieces: list of 12 occupancy masks (see plane ordering above)
+        turn: 1 if White to move, -1 if Black
+        castling: bit set of WHITE_LEFT, WHITE_RIGHT, BLACK_LEFT, BLACK_RIGHT
+        enPassant: en passant square number (None if not)
+        recentMoves: same history list as Board's "recentMoves"
+        key, mirrorKey, history, halfmoveClock, fullmoveNumber: as for Board"""
+        self.pieces = pieces
+        self.turn = turn
+        self.castling = castling
+        self.enPassant = enPassant
+        self.recentMoves = recentMoves
+        self.undoStack = [] # Undo records of moves played with make_move
+        if key is None or mirrorKey is None:
+            (key,mirrorKey) = _state_keys(castling, enPassant, turn)
+            for plane in range(12):
+                for square in squares(pieces[plane]):
+                    key ^= PIECE_KEYS[plane][square]
+                    mirrorKey ^= MIRROR_PIECE_KEYS[plane][square]
+        # Zobrist keys, equal to those of the equivalent Board and kept up
+        # to date by make_move/ unmake_move
+        self.key = key
+        self.mirrorKey = mirrorKey
+        self._init_history(history,halfmoveClock,fullmoveNumber)
+        self.board = BoardView(self)
+        # Lazily computed legal moves (keyed by player), "inCheck",
+        # "outcome", "squareCodes" and "mirror", reset whenever a move is made
+        self.derived = {}
+
+    @classmethod
+    def from_board(cls,board):
+        """Builds a BitBoard from a Board"""
+        (key,mirrorKey,history,halfmoveClock,fullmoveNumber) = (board.key, board.mirrorKey, dict(board.history), board.halfmoveClock, board.fullmoveNumber)
+        board = board.board
+        pieces = [0]*12
+        for square in board.keys():
+            if isinstance(square, tuple):
+                pieces[board[square].code] |= 1 << square_index(square)
+        castling = 0
+        (boolLeft,boolRight) = board["whiteCastlingRights"]
+        castling |= (WHITE_LEFT if boolLeft else 0) | (WHITE_RIGHT if boolRight else 0)
+        (boolLeft,boolRight) = board["blackCastlingRights"]
+        castling |= (BLACK_LEFT if boolLeft else 0) | (BLACK_RIGHT if boolRight else 0)
+        enPassant = board["enPassant"]
+        if enPassant is not None:
+            enPassant = square_index(enPassant)
+        return cls(pieces, board["turn"], castling, enPassant, list(board["recentMoves"]), key, mirrorKey, history, halfmoveClock, fullmoveNumber)
+
+    @classmethod
+    def from_fen(cls,fen):
+        """Builds a BitBoard from a FEN string, setting the plane bits
+        directly"""
+        fields = fen.split()
+        (placement,turn,castling,enPassant) = fields[:4]
+        pieces = [0]*12
+        square = 0
+        for letter in placement:
+            if letter.isdigit():
+                square += int(letter)
+            elif letter != "/":
+                pieces[FEN_LETTERS.index(letter)] |= 1 << square
+                square += 1
+        rights = 0
+        for (letter,bit) in (("K",WHITE_RIGHT), ("Q",WHITE_LEFT), ("k",BLACK_RIGHT), ("q",BLACK_LEFT)):
+            if letter in castling:
+                rights |= bit
+        enPassant = None if enPassant == "-" else square_index(parse_square(enPassant))
+        (halfmoveClock,fullmoveNumber) = parse_move_clocks(fields)
+        return cls(pieces, 1 if turn == "w" else -1, rights, enPassant, list(NO_RECENT_MOVES),
+            halfmoveClock=halfmoveClock, fullmoveNumber=fullmoveNumber)
+
+    def to_fen(self):
+        """Returns the FEN string of the position"""
+        letters = ["1"]*64
+        for plane in range(12):
+            for square in squares(self.pieces[plane]):
+                letters[square] = FEN_LETTERS[plane]
+        ranks = []
+        for row in range(8):
+            rank = ""
+            for letter in letters[8*row:8*row+8]:
+                if letter == "1" and rank[-1:].isdigit():
+                    rank = rank[:-1] + str(int(rank[-1]) + 1)
+                else:
+                    rank += letter
+            ranks.append(rank)
+        castling = "".join([letter for (letter,bit) in (("K",WHITE_RIGHT), ("Q",WHITE_LEFT), ("k",BLACK_RIGHT), ("q",BLACK_LEFT)) if self.castling & bit])
+        enPassant = "-" if self.enPassant is None else square_name(square_position(self.enPassant))
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.turn == 1 else "b", castling or "-", enPassant, self.halfmoveClock, self.fullmoveNumber)
+
+    def to_board(self):
+        """Converts back to the dict based Board"""
+        board = dict(self.board)
+        board["recentMoves"] = list(self.recentMoves)
+        return Board(board, self.key, self.mirrorKey, history=dict(self.history), halfmoveClock=self.halfmoveClock, fullmoveNumber=self.fullmoveNumber)
+
+    def flip(self):
+        """Returns the color flipped position (as Game.getCanonicalForm):
+        rows byte swapped and the white and black planes exchanged"""
+        pieces = [flip_rows(mask) for mask in self.pieces[6:] + self.pieces[:6]]
+        castling = ((self.castling & (WHITE_LEFT | WHITE_RIGHT)) << 2) | ((self.castling & (BLACK_LEFT | BLACK_RIGHT)) >> 2)
+        enPassant = None if self.enPassant is None else self.enPassant ^ 56
+        return BitBoard(pieces, -1*self.turn, castling, enPassant, self.recentMoves,
+            self.mirrorKey, self.key, dict(self.history), self.halfmoveClock, self.fullmoveNumber)
+
+    def mirror(self):
+        """Returns flip of this board, cached until the next move (see
+        Board.mirror)"""
+        if "mirror" not in self.derived:
+            self.derived["mirror"] = self.flip()
+        return self.derived["mirror"]
+
+    @property
+    def squareCodes(self):
+        """Board.squareCodes of the position, unpacked from the planes
+        (cached until the next move)"""
+        if not ("squareCodes" in self.derived):
+            squareCodes = np.full((68,), -1, dtype=np.int8)
+            for plane in range(12):
+                for square in squares(self.pieces[plane]):
+                    squareCodes[square] = plane
+            squareCodes[64:68] = [bool(self.castling & bit) for bit in (WHITE_LEFT, WHITE_RIGHT, BLACK_LEFT, BLACK_RIGHT)]
+            self.derived["squareCodes"] = squareCodes
+        return self.derived["squareCodes"]
+
+    def occupancy(self,color):
+        base = 6*side_index(color)
+        occupied = 0
+        for plane in range(base, base+6):
+            occupied |= self.pieces[plane]
+        return occupied
+
+    def king_position(self,color):
+        kings = self.pieces[6*side_index(color) + KING]
+        return square_position(kings.bit_length() - 1)
+
+    def piece_at(self,position):
+        """Returns the Piece standing on position (None if empty)"""
+        square = square_index(position)
+        for plane in range(12):
+            if (self.pieces[plane] >> square) & 1:
+                return PLANE_PIECES[plane][square]
+        return None
+
+    @property
+    def material(self):
+        """Number of pieces of each plane (see Board.material)"""
+        return [bin(mask).count("1") for mask in self.pieces]
+
+    def is_attacked(self,square,byColor):
+        """Returns True if any piece of color byColor attacks the (row,col)
+        square"""
+        return self.__attacked(square_index(square), byColor)
+
+    def __attacked(self,square,byColor):
+        """Returns True if any piece of byColor attacks the square number"""
+        pieces = self.pieces
+        side = side_index(byColor)
+        base = 6*side
+        if KNIGHT_ATTACKS[square] & pieces[base+KNIGHT]:
+            return True
+        if KING_ATTACKS[square] & pieces[base+KING]:
+            return True
+        if PAWN_ATTACKS[1-side][square] & pieces[base+PAWN]:
+            return True
+        rooks = pieces[base+ROOK] | pieces[base+QUEEN]
+        bishops = pieces[base+BISHOP] | pieces[base+QUEEN]
+        if not (rooks or bishops):
+            return False
+        occupied = 0
+        for mask in pieces:
+            occupied |= mask
+        if rooks and (slider_attacks(square, occupied, ORTHOGONAL) & rooks):
+            return True
+        if bishops and (slider_attacks(square, occupied, DIAGONAL) & bishops):
+            return True
+        return False
+
+    def is_in_check(self,board,kingPosition,color):
+        """Returns True of the given color is in check and False otherwise.
+        board is this BitBoard or its board view (as Board's dict)"""
+        if isinstance(board, BoardView):
+            board = board.bitBoard
+        return board.is_attacked(kingPosition, -1*color)
+
+    def _turn(self):
+        return self.turn
+
+    def _in_check(self):
+        return self.is_attacked(self.king_position(self.turn), -1*self.turn)
+
+    def _legal_moves(self,player):
+        """Generates the legal moves of player. Moves of unpinned pieces other
+        than the king are legal unless in check; the others (and en passant
+        captures) are toggled into the planes in place, the king tested, and
+        toggled back."""
+        allLegal = []
+        pieces = self.pieces
+        kingPlane = 6*side_index(player) + KING
+        king = pieces[kingPlane].bit_length() - 1
+        if self.__attacked(king, -1*player):
+            tested = ~0
+        else:
+            tested = self.__pinned(king, player) | pieces[kingPlane]
+        for (plane,fromSquare,toSquare) in self.__pseudo_legal_moves(player):
+            if ((tested >> fromSquare) & 1) or (toSquare == self.enPassant and plane % 6 == PAWN):
+                changes = self.__changes(plane, fromSquare, toSquare)
+                for (changedPlane,mask) in changes:
+                    pieces[changedPlane] ^= mask
+                legal = not self.__attacked(pieces[kingPlane].bit_length() - 1, -1*player)
+                for (changedPlane,mask) in changes:
+                    pieces[changedPlane] ^= mask
+            else:
+                legal = True
+            if legal:
+                allLegal.append(Move(PLANE_PIECES[plane][fromSquare], POSITIONS[toSquare]))
+        return allLegal
+
+    def execute_move(self,inputBoard,piece,newPosition,curPlayer):
+        """Returns the updated board state after making the input move"""
+        newBoard = BitBoard(list(inputBoard.pieces), inputBoard.turn, inputBoard.castling, inputBoard.enPassant,
+            inputBoard.recentMoves, inputBoard.key, inputBoard.mirrorKey, dict(inputBoard.history), inputBoard.halfmoveClock, inputBoard.fullmoveNumber)
+        newBoard.__play(piece.code, square_index(piece.position), square_index(newPosition))
+        return newBoard
+
+    def make_move(self,move):
+        """Plays the move on this board in place (see Board.make_move)"""
+        piece = move.piece
+        self.undoStack.append((self.__play(piece.code, square_index(piece.position), square_index(move.newSquare)), self.derived))
+        self.derived = {}
+
+    def unmake_move(self):
+        """Restores the state from before the last make_move"""
+        (undo,self.derived) = self.undoStack.pop()
+        (changes,turn,castling,enPassant,recentMoves,key,mirrorKey,history,halfmoveClock,fullmoveNumber) = undo
+        self._unrecord_move(history,halfmoveClock,fullmoveNumber)
+        pieces = self.pieces
+        for (plane,mask) in changes:
+            pieces[plane] ^= mask
+        (self.turn,self.castling,self.enPassant,self.recentMoves) = (turn,castling,enPassant,recentMoves)
+        (self.key,self.mirrorKey) = (key,mirrorKey)
+
+    def __pinned(self,king,color):
+        """Returns the mask of the pieces of color standing alone between
+        their king and an enemy slider moving along that line"""
+        pieces = self.pieces
+        enemyBase = 6*(1-side_index(color))
+        own = self.occupancy(color)
+        occupied = own | self.occupancy(-1*color)
+        pinned = 0
+        for (directions,sliders) in ((ORTHOGONAL, pieces[enemyBase+ROOK] | pieces[enemyBase+QUEEN]),
+                                     (DIAGONAL, pieces[enemyBase+BISHOP] | pieces[enemyBase+QUEEN])):
+            if not sliders:
+                continue
+            for direction in directions:
+                ray = RAYS[direction][king]
+                if not (ray & sliders):
+                    continue
+                blockers = ray & occupied
+                blocker = first_square(blockers, direction)
+                if (own >> blocker) & 1:
+                    beyond = blockers & ~(1 << blocker)
+                    if beyond and (sliders >> first_square(beyond, direction)) & 1:
+                        pinned |= 1 << blocker
+        return pinned
+
+    def __changes(self,plane,fromSquare,toSquare):
+        """Returns the (plane, mask) pairs whose bits toggle when the piece on
+        plane moves from fromSquare to toSquare. A capture, if any, is the
+        second pair."""
+        pieces = self.pieces
+        toBit = 1 << toSquare
+        side = plane // 6
+        enemyBase = 6*(1-side)
+        changes = [(plane, 1 << fromSquare)]
+        for enemyPlane in range(enemyBase, enemyBase+6):
+            if pieces[enemyPlane] & toBit:
+                changes.append((enemyPlane, toBit))
+                break
+        denomination = plane % 6
+        if denomination == PAWN:
+            if toSquare == self.enPassant:
+                captured = toSquare + 8 if side == 0 else toSquare - 8
+                changes.append((enemyBase+PAWN, 1 << captured))
+            if toSquare < 8 or toSquare >= 56:
+                plane = 6*side + QUEEN
+        elif denomination == KING:
+            if toSquare - fromSquare == 2:
+                changes.append((6*side+ROOK, (1 << (toSquare+1)) | (1 << (toSquare-1))))
+            elif toSquare - fromSquare == -2:
+                changes.append((6*side+ROOK, (1 << (toSquare-2)) | (1 << (toSquare+1))))
+        changes.append((plane, toBit))
+        return changes
+
+    def __play(self,plane,fromSquare,toSquare):
+        """Moves the piece on plane from fromSquare to toSquare in place,
+        updating the Zobrist keys, history and clock, and returns the undo
+        record: the toggled planes followed by the previous state"""
+        changes = self.__changes(plane, fromSquare, toSquare)
+        undo = (changes, self.turn, self.castling, self.enPassant, self.recentMoves,
+            self.key, self.mirrorKey, self.history, self.halfmoveClock, self.fullmoveNumber)
+        (stateKey,mirrorStateKey) = _state_keys(self.castling, self.enPassant, self.turn)
+        key = self.key ^ stateKey
+        mirrorKey = self.mirrorKey ^ mirrorStateKey
+        pieces = self.pieces
+        for (changedPlane,mask) in changes:
+            pieces[changedPlane] ^= mask
+            for square in squares(mask):
+                key ^= PIECE_KEYS[changedPlane][square]
+                mirrorKey ^= MIRROR_PIECE_KEYS[changedPlane][square]
+        self.castling &= ~(CASTLING_LOSS.get(fromSquare, 0) | CASTLING_LOSS.get(toSquare, 0))
+        isPawn = (plane % 6 == PAWN)
+        self.enPassant = (fromSquare + toSquare)//2 if isPawn and abs(toSquare - fromSquare) == 16 else None
+        self.turn = -1*self.turn
+        self.recentMoves = [(square_position(fromSquare),DENOMINATIONS[plane % 6],square_position(toSquare))] + self.recentMoves[:5]
+        (stateKey,mirrorStateKey) = _state_keys(self.castling, self.enPassant, self.turn)
+        self.key = key ^ stateKey
+        self.mirrorKey = mirrorKey ^ mirrorStateKey
+        # A capture is the second toggled pair (see __changes)
+        self._record_move(isPawn or (changes[1][0] // 6 != plane // 6))
+        return undo
+
+    def __pseudo_legal_moves(self,color):
+        """Yields (plane, fromSquare, toSquare) for every move obeying basic
+        piece movement rules, including castling through unattacked squares"""
+        pieces = self.pieces
+        side = side_index(color)
+        base = 6*side
+        own = self.occupancy(color)
+        enemy = self.occupancy(-1*color)
+        occupied = own | enemy
+        empty = ~occupied
+
+        forward = -8 if side == 0 else 8
+        startRow = 6 if side == 0 else 1
+        targets = enemy
+        if self.enPassant is not None:
+            targets |= 1 << self.enPassant
+        for fromSquare in squares(pieces[base+PAWN]):
+            oneStep = fromSquare + forward
+            if (empty >> oneStep) & 1:
+                yield (base+PAWN, fromSquare, oneStep)
+                twoStep = oneStep + forward
+                if fromSquare//8 == startRow and (empty >> twoStep) & 1:
+                    yield (base+PAWN, fromSquare, twoStep)
+            for toSquare in squares(PAWN_ATTACKS[side][fromSquare] & targets):
+                yield (base+PAWN, fromSquare, toSquare)
+
+        for fromSquare in squares(pieces[base+KNIGHT]):
+            for toSquare in squares(KNIGHT_ATTACKS[fromSquare] & ~own):
+                yield (base+KNIGHT, fromSquare, toSquare)
+        for (plane,directions) in ((BISHOP, DIAGONAL), (ROOK, ORTHOGONAL), (QUEEN, ORTHOGONAL + DIAGONAL)):
+            for fromSquare in squares(pieces[base+plane]):
+                for toSquare in squares(slider_attacks(fromSquare, occupied, directions) & ~own):
+                    yield (base+plane, fromSquare, toSquare)
+
+        for fromSquare in squares(pieces[base+KING]):
+            for toSquare in squares(KING_ATTACKS[fromSquare] & ~own):
+                yield (base+KING, fromSquare, toSquare)
+            (left,right) = (WHITE_LEFT,WHITE_RIGHT) if side == 0 else (BLACK_LEFT,BLACK_RIGHT)
+            if self.castling & (left | right) and not self.__attacked(fromSquare, -1*color):
+                if (self.castling & left) and not (occupied & (0b111 << (fromSquare-3))):
+                    if not (self.__attacked(fromSquare-1, -1*color) or self.__attacked(fromSquare-2, -1*color)):
+                        yield (base+KING, fromSquare, fromSquare-2)
+                if (self.castling & right) and not (occupied & (0b11 << (fromSquare+1))):
+                    if not (self.__attacked(fromSquare+1, -1*color) or self.__attacked(fromSquare+2, -1*color)):
+                        yield (base+KING, fromSquare, fromSquare+2)
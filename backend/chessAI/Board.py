@@ -1,37 +1,336 @@
-from chessAI.Piece import Piece
+from chessAI.Piece import Piece, DENOMINATIONS, FEN_LETTERS, square_name, parse_square, KNIGHT_TARGETS, KING_TARGETS, PAWN_ATTACKS, ROOK_RAYS, BISHOP_RAYS
 from chessAI.Move import Move
+from chessAI.Position import PositionMixin, PIECE_VALUES, parse_move_clocks
 import numpy as np
-import copy
+import random
 
-class Board(object):
+# Zobrist keys, drawn from a fixed seed so that every process hashes a
+# position to the same 64-bit key
+_zobristRandom = random.Random(20180516)
+ZOBRIST_PIECES = dict(((denomination,color,(row,col)), _zobristRandom.getrandbits(64))
+    for denomination in ["Pawn", "Knight", "Bishop", "Rook", "Queen", "King"]
+    for color in [1, -1] for row in range(8) for col in range(8))
+ZOBRIST_CASTLING = { "whiteCastlingRights": (_zobristRandom.getrandbits(64), _zobristRandom.getrandbits(64))
+    , "blackCastlingRights": (_zobristRandom.getrandbits(64), _zobristRandom.getrandbits(64))
+    }
+ZOBRIST_EN_PASSANT = [_zobristRandom.getrandbits(64) for col in range(8)] # Indexed by column
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+
+def _piece_key(piece):
+    return ZOBRIST_PIECES[(piece.denomination,piece.color,piece.position)]
+
+def _state_key(board):
+    """Zobrist key of the castling rights, en passant column and turn"""
+    key = 0
+    for rightsKey in ("whiteCastlingRights","blackCastlingRights"):
+        (boolLeft,boolRight) = board[rightsKey]
+        if boolLeft:
+            key ^= ZOBRIST_CASTLING[rightsKey][0]
+        if boolRight:
+            key ^= ZOBRIST_CASTLING[rightsKey][1]
+    if board["enPassant"] is not None:
+        key ^= ZOBRIST_EN_PASSANT[board["enPassant"][1]]
+    if (board["turn"] == -1):
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    return key
+
+def _mirror_state_key(board):
+    """_state_key of the color flipped board (castling rights swap sides,
+    the en passant column stays and the other side is to move)"""
+    key = 0
+    for (rightsKey,mirrorRightsKey) in (("whiteCastlingRights","blackCastlingRights"),("blackCastlingRights","whiteCastlingRights")):
+        (boolLeft,boolRight) = board[rightsKey]
+        if boolLeft:
+            key ^= ZOBRIST_CASTLING[mirrorRightsKey][0]
+        if boolRight:
+            key ^= ZOBRIST_CASTLING[mirrorRightsKey][1]
+    if board["enPassant"] is not None:
+        key ^= ZOBRIST_EN_PASSANT[board["enPassant"][1]]
+    if (board["turn"] == 1):
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    return key
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# FEN does not record the moves played, so boards built from one start
+# with placeholder recentMoves (as index.decodeBoard does)
+NO_RECENT_MOVES = [(0,0,0),(1,1,1),(2,2,2),(3,3,3),(4,4,4),(5,5,5)]
+
+def is_valid_fen(fen):
+    """Returns True if fen is a well formed FEN string that from_fen can
+    read: eight ranks of eight squares, one king of each color, a side to
+    move, castling and en passant fields and optional move clocks"""
+    fields = fen.split()
+    if not (4 <= len(fields) <= 6):
+        return False
+    (placement,turn,castling,enPassant) = fields[:4]
+    ranks = placement.split("/")
+    if len(ranks) != 8:
+        return False
+    for rank in ranks:
+        width = 0
+        for letter in rank:
+            if letter in "12345678":
+                width += int(letter)
+            elif letter in FEN_LETTERS:
+                width += 1
+            else:
+                return False
+        if width != 8:
+            return False
+    if (placement.count("K") != 1) or (placement.count("k") != 1):
+        return False
+    if turn not in ("w", "b"):
+        return False
+    if castling != "-" and (castling == "" or any([letter not in "KQkq" for letter in castling])):
+        return False
+    if enPassant != "-" and not (len(enPassant) == 2 and enPassant[0] in "abcdefgh" and enPassant[1] in "36"):
+        return False
+    return all([clock.isdigit() for clock in fields[4:]])
+
+# Index of the square reached by flipping the rows, in Board.squareCodes
+# order, and the code of each Piece.code after swapping colors (with -1 for
+# empty squares kept at the end, so that it is also found at index -1)
+FLIPPED_SQUARES = np.array([square ^ 56 for square in range(64)])
+FLIPPED_CODES = np.array([(code + 6) % 12 for code in range(12)] + [-1], dtype=np.int8)
+
+# Castling rights (dict key, 0 for left/1 for right) tied to each rook corner
+CORNER_ROOKS = { (0,0): ("blackCastlingRights",0)
+    , (0,7): ("blackCastlingRights",1)
+    , (7,0): ("whiteCastlingRights",0)
+    , (7,7): ("whiteCastlingRights",1)
+    }
+
+class Board(PositionMixin):
     """This class defines a chess game state"""
-    def __init__(self,board):
+    def __init__(self,board,key=None,mirrorKey=None,material=None,history=None,halfmoveClock=0,squareCodes=None,fullmoveNumber=1):
+        """board: dict from (row,col) squares to Pieces plus the state keys
+        key, mirrorKey: Zobrist keys of board and of its color flipped
+        board if already known (computed otherwise)
+        material: piece counts of board if already known (computed otherwise)
+        history: occurrences of each position since the last pawn move or
+        capture, keyed as _history_key (only this position if not given)
+        halfmoveClock: moves played since the last pawn move or capture
+        squareCodes: squareCodes of board if already known (computed otherwise)
+        fullmoveNumber: FEN fullmove number, counting black's moves from 1"""
         self.board = board
+        self.undoStack = [] # Undo records of moves played with make_move
+        if key is None or mirrorKey is None or material is None:
+            key = _state_key(board)
+            mirrorKey = _mirror_state_key(board)
+            material = [0]*12
+            for square in board.keys():
+                if isinstance(square, tuple):
+                    piece = board[square]
+                    key ^= _piece_key(piece)
+                    mirrorKey ^= _piece_key(piece.flip())
+                    material[piece.code] += 1
+        # Zobrist keys and number of pieces of each Piece.code, kept up to
+        # date by make_move/ unmake_move
+        self.key = key
+        self.mirrorKey = mirrorKey
+        self.material = material
+        self._init_history(history,halfmoveClock,fullmoveNumber)
+        if squareCodes is None:
+            squareCodes = np.full((68,), -1, dtype=np.int8)
+            for square in board.keys():
+                if isinstance(square, tuple):
+                    (row,col) = square
+                    squareCodes[row*8+col] = board[square].code
+            squareCodes[64:68] = board["whiteCastlingRights"] + board["blackCastlingRights"]
+        # Piece.code on each square (row*8+col, -1 if empty) followed by the
+        # white and black (left, right) castling rights, kept up to date by
+        # make_move/ unmake_move so boards are encoded without a dict scan
+        self.squareCodes = squareCodes
+        # Lazily computed legal moves (keyed by player), "inCheck", "outcome"
+        # (see position_outcome) and "mirror" of the current position, reset
+        # whenever a move is made
+        self.derived = {}
+
+    @classmethod
+    def from_fen(cls,fen):
+        """Builds a Board from a FEN string"""
+        fields = fen.split()
+        (placement,turn,castling,enPassant) = fields[:4]
+        board = {}
+        for (row,rank) in enumerate(placement.split("/")):
+            col = 0
+            for letter in rank:
+                if letter.isdigit():
+                    col += int(letter)
+                    continue
+                code = FEN_LETTERS.index(letter)
+                color = 1 if code < 6 else -1
+                board[(row,col)] = Piece(DENOMINATIONS[code % 6],color,(row,col))
+                if (code % 6 == 5):
+                    board["whiteKing" if color == 1 else "blackKing"] = (row,col)
+                col += 1
+        board["whiteCastlingRights"] = ("Q" in castling, "K" in castling)
+        board["blackCastlingRights"] = ("q" in castling, "k" in castling)
+        board["enPassant"] = None if enPassant == "-" else parse_square(enPassant)
+        board["recentMoves"] = list(NO_RECENT_MOVES)
+        board["turn"] = 1 if turn == "w" else -1
+        (halfmoveClock,fullmoveNumber) = parse_move_clocks(fields)
+        return cls(board,halfmoveClock=halfmoveClock,fullmoveNumber=fullmoveNumber)
+
+    def to_fen(self):
+        """Returns the FEN string of the position"""
+        board = self.board
+        ranks = []
+        for row in range(8):
+            rank = ""
+            empty = 0
+            for col in range(8):
+                if (row,col) in board:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += FEN_LETTERS[board[(row,col)].code]
+                else:
+                    empty += 1
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = "".join([letter for (letter,right) in zip("KQkq",
+            (board["whiteCastlingRights"][1], board["whiteCastlingRights"][0], board["blackCastlingRights"][1], board["blackCastlingRights"][0])) if right])
+        enPassant = "-" if board["enPassant"] is None else square_name(board["enPassant"])
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if board["turn"] == 1 else "b", castling or "-", enPassant, self.halfmoveClock, self.fullmoveNumber)
+
+    def _turn(self):
+        return self.board["turn"]
 
-    def legal_moves(self,player):
-        """Returns a list of all legal moves for the current game state"""
+    def _in_check(self):
         board = self.board
+        if (board["turn"] == 1):
+            return self.is_in_check(board,board["whiteKing"],1)
+        return self.is_in_check(board,board["blackKing"],-1)
+
+    def _legal_moves(self,player):
+        """Generates the legal moves of player. Checking and pinned pieces are
+        found once from the king's square, so moves are filtered without
+        playing them out and the board is left untouched."""
+        board = self.board
+        if (player == 1):
+            kingPosition = board["whiteKing"]
+        else:
+            kingPosition = board["blackKing"]
+        checks = self.__checks(board,kingPosition,-1*player)
+        pins = self.__pins(board,kingPosition,player)
+        enPassant = board["enPassant"]
         allLegal = []
         for square in board.keys():
             if isinstance(square, tuple):
                 piece = board[square]
                 if (piece.color == player):
-                    for move in self.__legal_piece_moves(piece):
-                        allLegal.append(Move(piece,move))
+                    if (piece.denomination == "King"):
+                        for move in self.__king_moves(piece,len(checks) == 0):
+                            allLegal.append(Move(piece,move))
+                    elif (len(checks) < 2):
+                        for move in piece.moves(board):
+                            if (piece.denomination == "Pawn") and (move == enPassant):
+                                if self.__is_legal_en_passant(piece,move):
+                                    allLegal.append(Move(piece,move))
+                            elif ((not checks) or (move in checks[0])) and ((not square in pins) or (move in pins[square])):
+                                allLegal.append(Move(piece,move))
         return allLegal
 
     def is_in_check(self,board,kingPosition,color):
         """Returns True of the given color is in check and False otherwise"""
-        return (kingPosition in self.__attacked_squares(board,-1*color))
+        return self.__is_attacked(board,kingPosition,-1*color)
+
+    def is_attacked(self,square,byColor):
+        """Returns True if any piece of color byColor attacks the square"""
+        return self.__is_attacked(self.board,square,byColor)
 
     def execute_move(self,inputBoard,piece,newPosition,curPlayer):
         """Returns the updated board state after making the input move"""
-        oldBoard = inputBoard.board
-        board = dict(oldBoard)
+        newBoard = Board(dict(inputBoard.board),inputBoard.key,inputBoard.mirrorKey,list(inputBoard.material),
+            dict(inputBoard.history),inputBoard.halfmoveClock,inputBoard.squareCodes.copy(),inputBoard.fullmoveNumber)
+        newBoard.__play(piece,newPosition,curPlayer)
+        return newBoard
+
+    def make_move(self,move):
+        """Plays the move on this board in place. The previous state is
+        kept in a small undo record so that unmake_move can restore it."""
+        self.undoStack.append((self.__play(move.piece,move.newSquare,move.piece.color),self.derived))
+        self.derived = {}
+
+    def unmake_move(self):
+        """Restores the state from before the last make_move"""
+        (undo,self.derived) = self.undoStack.pop()
+        (changed,whiteCastlingRights,blackCastlingRights,whiteKing,blackKing,enPassant,recentMoves,turn,key,mirrorKey,history,halfmoveClock,fullmoveNumber) = undo
+        board = self.board
+        material = self.material
+        self._unrecord_move(history,halfmoveClock,fullmoveNumber)
+        self.key = key
+        self.mirrorKey = mirrorKey
+        squareCodes = self.squareCodes
+        for (square,piece) in reversed(changed):
+            if square in board:
+                material[board[square].code] -= 1
+            (row,col) = square
+            if piece is None:
+                board.pop(square)
+                squareCodes[row*8+col] = -1
+            else:
+                material[piece.code] += 1
+                board[square] = piece
+                squareCodes[row*8+col] = piece.code
+        squareCodes[64:68] = whiteCastlingRights + blackCastlingRights
+        board["whiteCastlingRights"] = whiteCastlingRights
+        board["blackCastlingRights"] = blackCastlingRights
+        board["whiteKing"] = whiteKing
+        board["blackKing"] = blackKing
+        board["enPassant"] = enPassant
+        board["recentMoves"] = recentMoves
+        board["turn"] = turn
+
+    def mirror(self):
+        """Returns the board with rows flipped and colors swapped, so that
+        the side to move plays white. The result is cached until the next
+        move (its Zobrist keys are this board's keys swapped), so it is
+        shared: moves made on it must be unmade before this board moves."""
+        derived = self.derived
+        if "mirror" not in derived:
+            board = self.board
+            mirrored = {}
+            for square in board.keys():
+                if isinstance(square, tuple):
+                    piece = board[square].flip()
+                    mirrored[piece.position] = piece
+            mirrored["whiteCastlingRights"] = board["blackCastlingRights"]
+            mirrored["blackCastlingRights"] = board["whiteCastlingRights"]
+            mirrored["whiteKing"] = board[board["blackKing"]].flip().position
+            mirrored["blackKing"] = board[board["whiteKing"]].flip().position
+            enPassant = board["enPassant"]
+            mirrored["enPassant"] = None if enPassant is None else (7-enPassant[0],enPassant[1])
+            mirrored["recentMoves"] = board["recentMoves"]
+            mirrored["turn"] = -1*board["turn"]
+            material = self.material
+            squareCodes = np.empty((68,), dtype=np.int8)
+            squareCodes[:64] = FLIPPED_CODES[self.squareCodes[FLIPPED_SQUARES]]
+            squareCodes[64:66] = self.squareCodes[66:68]
+            squareCodes[66:68] = self.squareCodes[64:66]
+            derived["mirror"] = Board(mirrored,self.mirrorKey,self.key,material[6:] + material[:6],
+                dict(self.history),self.halfmoveClock,squareCodes,self.fullmoveNumber)
+        return derived["mirror"]
+
+    def __play(self,piece,newPosition,curPlayer):
+        """Moves piece to newPosition in place, updating the Zobrist key, and
+        returns the undo record: the previous occupant of every square
+        touched followed by the previous values of the non square keys and
+        of the Zobrist key"""
+        board = self.board
+        oldPosition = piece.position
         denomination = piece.denomination
-        (oldRow,oldCol) = piece.position
+        (oldRow,oldCol) = oldPosition
         (newRow,newCol) = newPosition
         oldEnPassant = board["enPassant"]
+        changed = [(oldPosition,board[oldPosition]), (newPosition,board.get(newPosition))]
+        undo = (changed, board["whiteCastlingRights"], board["blackCastlingRights"], board["whiteKing"],
+            board["blackKing"], oldEnPassant, board["recentMoves"], board["turn"], self.key, self.mirrorKey,
+            self.history, self.halfmoveClock, self.fullmoveNumber)
+        key = self.key ^ _state_key(board)
+        mirrorKey = self.mirrorKey ^ _mirror_state_key(board)
         if ((denomination == "Pawn") and (newRow == 0 or newRow == 7)):
             denomination = "Queen"
         board["enPassant"] = None
@@ -43,173 +342,173 @@ class Board(object):
                 board["blackCastlingRights"] = (False,False)
                 board["blackKing"] = newPosition
             if ((newCol-oldCol)>1):
+                changed.append(((newRow,7),board[(newRow,7)]))
+                changed.append(((newRow,newCol-1),None))
                 board[(newRow,newCol-1)] = Piece("Rook",curPlayer,(newRow,newCol-1))
                 board.pop((newRow,7))
             elif ((newCol - oldCol)<-1):
+                changed.append(((newRow,0),board[(newRow,0)]))
+                changed.append(((newRow,newCol+1),None))
                 board[(newRow,newCol+1)] = Piece("Rook",curPlayer,(newRow,newCol+1))
                 board.pop((newRow,0))
         elif (denomination == "Pawn"):
             if (newPosition == oldEnPassant):
-                if (curPlayer == 1):
-                    board.pop((newRow+1,newCol))
-                else:
-                    board.pop((newRow-1,newCol))
+                capturedPosition = (newRow+curPlayer,newCol)
+                changed.append((capturedPosition,board[capturedPosition]))
+                board.pop(capturedPosition)
             if (abs(newRow-oldRow)>1):
-                if (curPlayer == 1):
-                    board["enPassant"] = (newRow+1,newCol)
+                board["enPassant"] = (newRow+curPlayer,newCol)
+        # Moving from or capturing on a corner removes the castling rights of that rook
+        for square in (oldPosition,newPosition):
+            if square in CORNER_ROOKS:
+                (rightsKey,side) = CORNER_ROOKS[square]
+                (boolLeft,boolRight) = board[rightsKey]
+                if (side == 0):
+                    board[rightsKey] = (False,boolRight)
                 else:
-                    board["enPassant"] = (newRow-1,newCol)
-        elif (denomination == "Rook"):
-            if (curPlayer == 1):
-                (boolLeft,boolRight) = board["whiteCastlingRights"]
-                if (oldCol == 0):
-                    board["whiteCastlingRights"] = (False,boolRight)
-                elif (oldCol == 7):
-                    board["whiteCastlingRights"] = (boolLeft,False)
-            else:
-                (boolLeft,boolRight) = board["blackCastlingRights"]
-                if (oldCol == 0):
-                    board["blackCastlingRights"] = (False,boolRight)
-                elif (oldCol == 7):
-                    board["blackCastlingRights"] = (boolLeft,False)
-        # Account for if rooks are captured to avoid key errors
-        if (newPosition == (0,0)):
-            (boolLeft,boolRight) = board["blackCastlingRights"]
-            board["blackCastlingRights"] = (False, boolRight)
-        elif (newPosition == (0,7)):
-            (boolLeft,boolRight) = board["blackCastlingRights"]
-            board["blackCastlingRights"] = (boolLeft, False)
-        elif (newPosition == (7,0)):
-            (boolLeft,boolRight) = board["whiteCastlingRights"]
-            board["whiteCastlingRights"] = (False, boolRight)
-        elif (newPosition == (7,7)):
-            (boolLeft,boolRight) = board["whiteCastlingRights"]
-            board["whiteCastlingRights"] = (boolLeft, False)
+                    board[rightsKey] = (boolLeft,False)
         board[newPosition] = Piece(denomination,curPlayer,newPosition)
-        board.pop((oldRow,oldCol))
+        board.pop(oldPosition)
         board["turn"] = -1*board["turn"]
-        board["recentMoves"] = [(piece.position,piece.denomination,newPosition)] + board["recentMoves"][:5]
-        return Board(board)
-
-    def no_wins(self):
-        whiteMinorPieces = 0
-        blackMinorPieces = 0
-        for square in self.board.keys():
-            if isinstance(square, tuple):
-                piece = self.board[square]
-                if ((piece.denomination == "Queen") or (piece.denomination == "Rook") or (piece.denomination == "Pawn")):
-                    return False
-                elif ((piece.denomination == "Knight") or (piece.denomination == "Bishop")):
-                    if (piece.color == 1):
-                        whiteMinorPieces += 1
-                    else:
-                        blackMinorPieces += 1
-                else:
-                    pass
-        if (whiteMinorPieces > 1) or (blackMinorPieces >1):
-            return False
-        else:
-            return True
-
-    def repetition(self):
-        (W1,B1,W2,B2,W3,B3) = self.board["recentMoves"]
-        return ((W1 == W3) and (B1 == B3) and (W1[0] == W2[2]) and (W2[0] == W1[2]) and (B1[0] == B2[2]) and (B2[0] == B1[2]))
-
-    def __try_move(self,board,piece,newPosition):
-        """Updates and produces a new board to test for moving into checks.
-        Quicker to check and doesn't update the current game state or
-        account for castling rights, or a new en passant status.
-        Doesn't need to try castling because all of that logic is
-        built into __can_castle."""
-        newBoard = dict(board)
-        (newRow,newCol) = newPosition
-        newBoard[newPosition] = piece
-        newBoard.pop(piece.position)
-        if (piece.denomination == "Pawn"):
-            if (newPosition == board["enPassant"]):
-                if (piece.color == 1):
-                    newBoard.pop((newRow+1,newCol))
-                else:
-                    newBoard.pop((newRow-1,newCol))
-        return newBoard
+        board["recentMoves"] = [(oldPosition,piece.denomination,newPosition)] + board["recentMoves"][:5]
+        material = self.material
+        squareCodes = self.squareCodes
+        for (square,oldPiece) in changed:
+            if oldPiece is not None:
+                key ^= _piece_key(oldPiece)
+                mirrorKey ^= _piece_key(oldPiece.flip())
+                material[oldPiece.code] -= 1
+            (row,col) = square
+            if square in board:
+                newPiece = board[square]
+                key ^= _piece_key(newPiece)
+                mirrorKey ^= _piece_key(newPiece.flip())
+                material[newPiece.code] += 1
+                squareCodes[row*8+col] = newPiece.code
+            else:
+                squareCodes[row*8+col] = -1
+        if (board["whiteCastlingRights"] != undo[1]) or (board["blackCastlingRights"] != undo[2]):
+            squareCodes[64:68] = board["whiteCastlingRights"] + board["blackCastlingRights"]
+        self.key = key ^ _state_key(board)
+        self.mirrorKey = mirrorKey ^ _mirror_state_key(board)
+        self._record_move((piece.denomination == "Pawn") or (changed[1][1] is not None))
+        return undo
 
     def __can_castle(self,color):
         """Checks if castling is legal in the current game state
         for the given color (removes possibility of moving into/ through checks)"""
         board = self.board
-        occupied = board.keys()
         if (color == 1):
             (row,col) = board["whiteKing"]
             (boolLeft,boolRight) = board["whiteCastlingRights"]
         else:
             (row,col) = board["blackKing"]
             (boolLeft,boolRight) = board["blackCastlingRights"]
-        attacked = self.__attacked_squares(board,-1*color)
-        if boolLeft:
-            if (not ( ((row,col-1) in occupied) or ((row, col-2) in occupied) or ((row, col-3) in occupied) ) ):
-                if (not ( ((row,col) in attacked) or ((row,col-1) in attacked) or ((row, col-2) in attacked)) ):
-                    canCastleLeft = True
-                else:
-                    canCastleLeft = False
-            else:
-                canCastleLeft = False
-        else:
-            canCastleLeft = False
-        if boolRight:
-            if (not ( ((row,col+1) in occupied) or ((row, col+2) in occupied) ) ):
-                if (not ( ((row,col) in attacked) or ((row,col+1) in attacked) or ((row, col+2) in attacked)) ):
-                    canCastleRight = True
-                else:
-                    canCastleRight = False
-            else:
-                canCastleRight = False
-        else:
-            canCastleRight = False
+        if (not (boolLeft or boolRight)) or self.is_attacked((row,col),-1*color):
+            return (False,False)
+        canCastleLeft = (boolLeft
+            and not ( ((row,col-1) in board) or ((row, col-2) in board) or ((row, col-3) in board) )
+            and not ( self.is_attacked((row,col-1),-1*color) or self.is_attacked((row,col-2),-1*color) ))
+        canCastleRight = (boolRight
+            and not ( ((row,col+1) in board) or ((row, col+2) in board) )
+            and not ( self.is_attacked((row,col+1),-1*color) or self.is_attacked((row,col+2),-1*color) ))
         return (canCastleLeft,canCastleRight)
 
 
-    def __attacked_squares(self,board,color):
-        """Returns a list of all squares attacked by any piece of the given color"""
-        enPassant = board["enPassant"]
-        attacked = []
-        for square in board.keys():
-            if isinstance(square, tuple):
-                piece = board[square]
-                if (piece.color == color):
-                    attacked = attacked + piece.moves(board)
-        attacked = list(set(attacked))
-        return attacked
-
+    def __is_attacked(self,board,square,color,vacated=(),filled=None):
+        """Looks outward from square along knight, pawn, king and slider
+        rays and stops at the first attacker of the given color. Squares in
+        vacated are seen as empty and filled as blocked, so a move can be
+        tested without playing it."""
+        for position in KNIGHT_TARGETS[square]:
+            if (position in board) and (board[position].color == color) and (board[position].denomination == "Knight") and not (position in vacated):
+                return True
+        for position in PAWN_ATTACKS[-1*color][square]:
+            if (position in board) and (board[position].color == color) and (board[position].denomination == "Pawn") and not (position in vacated):
+                return True
+        for position in KING_TARGETS[square]:
+            if (position in board) and (board[position].color == color) and (board[position].denomination == "King"):
+                return True
+        for (rays,sliders) in ((ROOK_RAYS,("Rook","Queen")), (BISHOP_RAYS,("Bishop","Queen"))):
+            for ray in rays[square]:
+                for position in ray:
+                    if position == filled:
+                        break
+                    if (position in board) and not (position in vacated):
+                        piece = board[position]
+                        if (piece.color == color) and (piece.denomination in sliders):
+                            return True
+                        break
+        return False
 
-    def __filter_checks(self,piece):
-        """Takes in a piece and filters all moves that are
-        illegal due to moving into check."""
-        board = self.board
-        moves = piece.moves(board)
-        color = piece.color
-        legalMoves = []
-        for move in moves:
-            if (piece.denomination == "King"):
-                if ( not (self.is_in_check(self.__try_move(board,piece,move),move,color)) ):
-                    legalMoves.append(move)
-            else:
-                if (color == 1):
-                    if ( not (self.is_in_check(self.__try_move(board,piece,move),board["whiteKing"],color)) ):
-                        legalMoves.append(move)
-                else:
-                    if ( not (self.is_in_check(self.__try_move(board,piece,move),board["blackKing"],color)) ):
-                        legalMoves.append(move)
-        return legalMoves
+    def __checks(self,board,square,color):
+        """Looks outward from square for pieces of the given color attacking
+        it. Returns one set per attacker holding the attacker's square and,
+        for sliders, the squares in between (the moves that stop the attack)."""
+        checks = []
+        for position in KNIGHT_TARGETS[square]:
+            if (position in board) and (board[position].color == color) and (board[position].denomination == "Knight"):
+                checks.append(set([position]))
+        for position in PAWN_ATTACKS[-1*color][square]:
+            if (position in board) and (board[position].color == color) and (board[position].denomination == "Pawn"):
+                checks.append(set([position]))
+        for position in KING_TARGETS[square]:
+            if (position in board) and (board[position].color == color) and (board[position].denomination == "King"):
+                checks.append(set([position]))
+        for (rays,sliders) in ((ROOK_RAYS,("Rook","Queen")), (BISHOP_RAYS,("Bishop","Queen"))):
+            for ray in rays[square]:
+                for (index,position) in enumerate(ray):
+                    if position in board:
+                        piece = board[position]
+                        if (piece.color == color) and (piece.denomination in sliders):
+                            checks.append(set(ray[:index+1]))
+                        break
+        return checks
 
+    def __pins(self,board,kingPosition,color):
+        """Returns a dict mapping the square of every piece of the given color
+        pinned to its king onto the set of squares it may still move to"""
+        pins = {}
+        for (rays,sliders) in ((ROOK_RAYS,("Rook","Queen")), (BISHOP_RAYS,("Bishop","Queen"))):
+            for ray in rays[kingPosition]:
+                pinned = None
+                for (index,position) in enumerate(ray):
+                    if position in board:
+                        piece = board[position]
+                        if pinned is None:
+                            if (piece.color != color):
+                                break
+                            pinned = position
+                        else:
+                            if (piece.color != color) and (piece.denomination in sliders):
+                                pins[pinned] = set(ray[:index+1])
+                            break
+        return pins
 
-    def __legal_piece_moves(self,piece):
-        """Accounts for castling when checking for possible moves"""
-        moves = self.__filter_checks(piece)
-        if piece.denomination == "King":
-            (canCastleLeft,canCastleRight) = self.__can_castle(piece.color)
-            (row,col) = piece.position
+    def __king_moves(self,king,canCastle):
+        """King moves to squares not attacked once the king has left its
+        square (so it cannot step back along a checking ray), plus castling"""
+        board = self.board
+        kingPosition = king.position
+        color = king.color
+        moves = []
+        for move in king.moves(board):
+            if not self.__is_attacked(board,move,-1*color,(kingPosition,)):
+                moves.append(move)
+        if canCastle:
+            (canCastleLeft,canCastleRight) = self.__can_castle(color)
+            (row,col) = kingPosition
             if canCastleRight:
                 moves.append((row,col+2))
             if canCastleLeft:
                 moves.append((row,col-2))
         return moves
+
+    def __is_legal_en_passant(self,piece,move):
+        """En passant removes two pieces from a rank, so the king is tested
+        with the capturing and captured pawns' squares empty and the pawn
+        on the en passant square"""
+        board = self.board
+        kingPosition = board["whiteKing"] if (piece.color == 1) else board["blackKing"]
+        capturedPosition = (piece.position[0],move[1])
+        return not self.__is_attacked(board,kingPosition,-1*piece.color,(piece.position,capturedPosition),move)
@@ -1,11 +1,11 @@
-from collections import deque
 from chessAI.Arena import Arena
 from chessAI.MCTS import MCTS
 import numpy as np
 from chessAI.pytorch_classification.utils import Bar, AverageMeter
 import time, os, sys
 from pickle import Pickler, Unpickler
-from random import shuffle, random
+from random import random
+from chessAI.Examples import pack_policy, compact_example, ExampleSet
 
 
 class Coach():
@@ -32,11 +32,15 @@ class Coach():
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
         uses temp=0.
         Returns:
-            trainExamples: a list of examples of the form (canonicalBoard,pi,v)
-                           pi is the MCTS informed policy vector, v is +1 if
-                           the player eventually won the game, else -1.
+            trainExamples: an ExampleSet of examples (canonicalBoard,pi,v)
+                           canonicalBoard is the bit-packed one-hot board,
+                           pi the nonzero (action, prob) records of the MCTS
+                           informed policy vector, v is +1 if the player
+                           eventually won the game, else -1.
         """
-        trainExamples = []
+        boards = []
+        players = []
+        policies = []
         board = self.game.getInitBoard()
         self.curPlayer = 1
         episodeStep = 0
@@ -49,20 +53,25 @@ class Coach():
             pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
             sym = self.game.getSymmetries(canonicalBoard, pi)
             for b,p in sym:
-                trainExamples.append([self.game.one_hot(b), self.curPlayer, p, None])
+                boards.append(b)
+                players.append(self.curPlayer)
+                policies.append(pack_policy(p))
 
             action = np.random.choice(len(pi), p=pi)
-            onehot_action = np.zeros((4096,))
-            onehot_action[action] = 1
-            board, self.curPlayer = self.game.getNextState(board, self.curPlayer, onehot_action)
+            board, self.curPlayer = self.game.getNextState(board, self.curPlayer, action)
+            # keep the searched subtree of the position reached
+            self.mcts.advance(self.game.getCanonicalForm(board, self.curPlayer))
 
             r = self.game.getGameEnded(board, self.curPlayer)
 
             if r!=0:
-                return [(x[0],x[2],r*((-1)**(x[1]!=self.curPlayer))) for x in trainExamples]
-
-            if (episodeStep > 600):
-                return [(x[0],x[2],1e-12) for x in trainExamples]
+                values = r*np.where(np.array(players) == self.curPlayer, 1, -1)
+            elif (episodeStep > 600):
+                values = np.full(len(players), 1e-12)
+            else:
+                continue
+            boards = np.packbits(self.game.one_hot_batch(boards), axis=1)
+            return ExampleSet.from_arrays(boards, policies, values)
 
     def learn(self):
         """
@@ -81,7 +90,7 @@ class Coach():
             print('------ITER ' + str(i) + '------')
             # examples of the iteration
             if not self.skipFirstSelfPlay or i>1:
-                iterationTrainExamples = deque([], maxlen=self.args['maxlenOfQueue'])
+                episodeExamples = []
 
                 eps_time = AverageMeter()
                 bar = Bar('Self Play', max=self.args['numEps'])
@@ -89,7 +98,7 @@ class Coach():
 
                 for eps in range(self.args['numEps']):
                     self.mcts = MCTS(self.game, self.nnets, self.args)   # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+                    episodeExamples.append(self.executeEpisode())
 
                     # bookkeeping + plot progress
                     eps_time.update(time.time() - end)
@@ -99,8 +108,8 @@ class Coach():
                     bar.next()
                 bar.finish()
 
-                # save the iteration examples to the history
-                self.trainExamplesHistory.append(iterationTrainExamples)
+                # save the maxlenOfQueue latest examples of the iteration to the history
+                self.trainExamplesHistory.append(ExampleSet.concatenate(episodeExamples, last=self.args['maxlenOfQueue']))
 
             if len(self.trainExamplesHistory) > self.args['numItersForTrainExamplesHistory']:
                 print("len(trainExamplesHistory) =", len(self.trainExamplesHistory), " => remove the oldest trainExamples")
@@ -110,10 +119,8 @@ class Coach():
             self.saveTrainExamples(i-1)
 
             # shuffle examlpes before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+            trainExamples = ExampleSet.concatenate(self.trainExamplesHistory)
+            trainExamples = trainExamples[np.random.permutation(len(trainExamples))]
             # training new network, keeping a copy of the old one
             self.nnets[0].save_checkpoint(folder=self.args['checkpoint'], filename='temp.pth.tar')
             list(map(lambda i :self.pnets[i].load_checkpoint(folder=self.args['checkpoint'], filename='temp.pth.tar'), list(range(4))))
@@ -163,5 +170,9 @@ class Coach():
             with open(examplesFile, "rb") as f:
                 self.trainExamplesHistory = Unpickler(f).load()
             f.closed
+            # older versions saved deques of (board, pi, v) tuples
+            self.trainExamplesHistory = [examples if isinstance(examples, ExampleSet)
+                                         else ExampleSet.from_examples([compact_example(e) for e in examples][-self.args['maxlenOfQueue']:])
+                                         for examples in self.trainExamplesHistory]
             # examples based on the model were already collected (loaded)
             self.skipFirstSelfPlay = True
@@ -0,0 +1,86 @@
+"""Streaming reader for EPD files (one FEN position per line followed by
+"opcode operand;" operations, as used by test suites and opening sets) and
+a bulk loader that packs the positions into the compact board format of
+chessAI.Examples without building a Board for each one.
+"""
+import numpy as np
+from chessAI.Piece import FEN_LETTERS
+from chessAI.Game import PIECE_FEATURES
+
+def read_epd(source):
+    """
+    Input:
+        source: path of an EPD file or an iterable of lines
+    Yields:
+        (fen, operations) for each non empty line, where fen holds the four
+        position fields plus the move clocks ("0 1" when not given) and
+        operations maps each opcode to its operand string (perft suites
+        written as ";D1 20 ;D2 400" give {"D1": "20", "D2": "400"})
+    """
+    if isinstance(source, str):
+        with open(source) as lines:
+            for record in read_epd(lines):
+                yield record
+        return
+    for line in source:
+        fields = line.split(None, 4)
+        if len(fields) < 4:
+            continue
+        rest = fields[4] if len(fields) > 4 else ""
+        clocks = rest.split(None, 2)
+        if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+            fen = " ".join(fields[:4] + clocks[:2])
+            rest = clocks[2] if len(clocks) > 2 else ""
+        else:
+            fen = " ".join(fields[:4]) + " 0 1"
+        operations = {}
+        for operation in rest.split(";"):
+            operation = operation.split(None, 1)
+            if operation:
+                operations[operation[0]] = operation[1].strip().strip('"') if len(operation) > 1 else ""
+        yield (fen, operations)
+
+def fen_one_hot(fen, out):
+    """Fills out (772 entries, zeroed) with Game.one_hot of the canonical
+    form of the FEN position: colors and rows are flipped when black is to
+    move, as Game.getCanonicalForm does"""
+    (placement, turn, castling) = fen.split(None, 3)[:3]
+    flip = (turn == "b")
+    square = 0
+    for letter in placement:
+        if letter.isdigit():
+            square += int(letter)
+        elif letter != "/":
+            code = FEN_LETTERS.index(letter)
+            if flip:
+                out[12*(square ^ 56) + PIECE_FEATURES[(code + 6) % 12]] = 1
+            else:
+                out[12*square + PIECE_FEATURES[code]] = 1
+            square += 1
+    rights = ("Q" in castling, "K" in castling, "q" in castling, "k" in castling)
+    if flip:
+        rights = rights[2:] + rights[:2]
+    out[768:772] = rights
+    return out
+
+def load_epd(source, chunkSize=4096):
+    """
+    Input:
+        source: path of an EPD file or an iterable of lines
+        chunkSize: number of positions encoded at once
+    Returns:
+        boards: (N,97) uint8 array of packed canonical one-hot boards (see
+                chessAI.Examples.pack_board), read in a single pass
+    """
+    chunk = np.zeros((chunkSize, 772), dtype=np.uint8)
+    packed = []
+    count = 0
+    for (fen, operations) in read_epd(source):
+        fen_one_hot(fen, chunk[count])
+        count += 1
+        if count == chunkSize:
+            packed.append(np.packbits(chunk, axis=1))
+            chunk[:] = 0
+            count = 0
+    packed.append(np.packbits(chunk[:count], axis=1))
+    return np.concatenate(packed)
@@ -0,0 +1,113 @@
+import numpy as np
+
+BOARD_BYTES = 97 # The 772 one-hot board features packed 8 to a byte
+POLICY_DTYPE = np.dtype([("action", np.uint16), ("prob", np.float16)])
+# One record per example of an ExampleSet: the packed board, the value and
+# the slice of the example's (action, prob) records in the flat policies
+EXAMPLE_DTYPE = np.dtype([("board", np.uint8, (BOARD_BYTES,)), ("value", np.float32)
+    , ("policyStart", np.int64), ("policyCount", np.int32)])
+
+def pack_board(oneHot):
+    """Packs a one-hot board vector (see Game.one_hot) into 97 bytes"""
+    return np.packbits(np.asarray(oneHot, dtype=np.uint8))
+
+def pack_policy(pi):
+    """Returns a record array of the (action, prob) pairs of the nonzero
+    entries of a dense policy vector"""
+    pi = np.asarray(pi)
+    actions = np.flatnonzero(pi)
+    policy = np.empty(len(actions), dtype=POLICY_DTYPE)
+    policy["action"] = actions
+    policy["prob"] = pi[actions]
+    return policy
+
+def pack_example(oneHot, pi, v):
+    """Returns the compact (board, policy, v) form of a training example"""
+    return (pack_board(oneHot), pack_policy(pi), v)
+
+def compact_example(example):
+    """Packs an example stored with a dense board and policy (as saved by
+    older versions); compact examples are returned unchanged"""
+    (board, pi, v) = example
+    if len(board) == BOARD_BYTES:
+        return example
+    return pack_example(board, pi, v)
+
+class ExampleSet(object):
+    """
+    Training examples stored contiguously: an EXAMPLE_DTYPE record array and
+    the flat POLICY_DTYPE array its records point into. Indexing (a slice,
+    an index array or a permutation) selects records and shares policies.
+    """
+    def __init__(self, records, policies):
+        self.records = records
+        self.policies = policies
+
+    @classmethod
+    def from_arrays(cls, boards, policies, values):
+        """
+        Input:
+            boards: (N,97) uint8 array of packed boards (see pack_board)
+            policies: sequence of N policy record arrays (see pack_policy)
+            values: N values
+        """
+        counts = np.array([len(policy) for policy in policies], dtype=np.int64)
+        records = np.empty(len(counts), dtype=EXAMPLE_DTYPE)
+        records["board"] = np.asarray(boards, dtype=np.uint8).reshape(-1, BOARD_BYTES)
+        records["value"] = values
+        records["policyStart"] = np.cumsum(counts) - counts
+        records["policyCount"] = counts
+        if len(counts) == 0:
+            return cls(records, np.empty(0, dtype=POLICY_DTYPE))
+        return cls(records, np.concatenate(policies).astype(POLICY_DTYPE, copy=False))
+
+    @classmethod
+    def from_examples(cls, examples):
+        """Stores a sequence of compact (board, policy, v) examples"""
+        if len(examples) == 0:
+            return cls.from_arrays(np.empty((0, BOARD_BYTES), dtype=np.uint8), [], [])
+        (boards, policies, values) = list(zip(*examples))
+        return cls.from_arrays(np.stack(boards), policies, values)
+
+    @classmethod
+    def concatenate(cls, exampleSets, last=None):
+        """Returns the examples of all exampleSets (only the last ones if
+        given) in a new ExampleSet whose policies hold only their records"""
+        records = np.concatenate([exampleSet.records for exampleSet in exampleSets]
+            + [np.empty(0, dtype=EXAMPLE_DTYPE)])
+        policies = [exampleSet.policies[exampleSet.policy_indices()] for exampleSet in exampleSets]
+        policies = np.concatenate(policies + [np.empty(0, dtype=POLICY_DTYPE)])
+        counts = records["policyCount"].astype(np.int64)
+        records["policyStart"] = np.cumsum(counts) - counts
+        if last is not None and len(records) > last:
+            return cls.concatenate([cls(records, policies)[len(records)-last:]])
+        return cls(records, policies)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return ExampleSet(self.records[index], self.policies)
+
+    def policy_indices(self):
+        """Returns the index in policies of every record of each example,
+        in example order"""
+        counts = self.records["policyCount"].astype(np.int64)
+        offsets = np.repeat(self.records["policyStart"] - (np.cumsum(counts) - counts), counts)
+        return np.arange(counts.sum()) + offsets
+
+    def expand(self, actionSize=4096):
+        """
+        Returns:
+            boards: (N,772) float32 array of one-hot boards
+            targets: (N,1+actionSize) float32 array holding v followed by the
+                     dense policy, as expected by NeuralNet
+        """
+        records = self.records
+        boards = np.unpackbits(records["board"], axis=1)[:, :772].astype(np.float32)
+        targets = np.zeros((len(records), 1+actionSize), dtype=np.float32)
+        targets[:, 0] = records["value"]
+        rows = np.repeat(np.arange(len(records)), records["policyCount"])
+        policies = self.policies[self.policy_indices()]
+        targets[rows, 1+policies["action"].astype(np.intp)] = policies["prob"]
+        return boards, targets
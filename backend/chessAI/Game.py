@@ -1,15 +1,25 @@
-from chessAI.Piece import Piece
+from chessAI.Piece import Piece, DENOMINATIONS
 from chessAI.Board import Board
-from chessAI.Move import one_hot_to_move
+from chessAI.Move import Move, action_to_move
 import numpy as np
 
+# Index of the feature set for each Piece.code within a square's 12 features
+PIECE_FEATURES = [Piece(denomination,color,(0,0)).one_hot().index(1) for color in (1,-1) for denomination in DENOMINATIONS]
+PIECE_FEATURE_ARRAY = np.array(PIECE_FEATURES)
+
 class Game():
     """
     This class specifies the base Game class. T
     Use 1 for player1 and -1 for player2.
     """
-    def __init__(self):
-        pass
+    def __init__(self, boardClass=Board):
+        """
+        Input:
+            boardClass: board backend the games start from, Board or
+                        BitBoard (any class with Board's interface and a
+                        from_board conversion)
+        """
+        self.boardClass = boardClass
 
     def getInitBoard(self):
         """
@@ -56,19 +66,52 @@ class Game():
             , "recentMoves": [(0,0,0),(1,1,1),(2,2,2),(3,3,3),(4,4,4),(5,5,5)]
             , "turn": 1 #Keeps track of which players turn it is (1 for white, -1 for black)
             }
-        return Board(startBoard)
+        if self.boardClass is Board:
+            return Board(startBoard)
+        return self.boardClass.from_board(Board(startBoard))
+
+    def one_hot(self,board,out=None):
+        """
+        Input:
+            board: current board
+            out: optional preallocated array of 772 entries to fill in place
+                 (e.g. a row of a batch)
+        Returns:
+            outVec: uint8 array with 12 piece features for each of the 64
+                    squares (see Piece.one_hot) followed by the white and
+                    black (left, right) castling rights
+        """
+        if out is None:
+            out = np.zeros((772,), dtype=np.uint8)
+        else:
+            out[:] = 0
+        codes = board.squareCodes[:64]
+        squares = np.flatnonzero(codes >= 0)
+        out[12*squares + PIECE_FEATURE_ARRAY[codes[squares]]] = 1
+        out[768:772] = board.squareCodes[64:]
+        return out
 
-    def one_hot(self,board):
-        outVec = []
-        for i in range(8):
-            for j in range(8):
-                if (i,j) in board.board.keys():
-                    outVec = outVec + board.board[(i,j)].one_hot()
-                else:
-                    outVec = outVec + [0,0,0,0,0,0,0,0,0,0,0,0]
-        outVec = outVec + [board.board["whiteCastlingRights"][0]*1, board.board["whiteCastlingRights"][1]*1]
-        outVec = outVec + [board.board["blackCastlingRights"][0]*1, board.board["blackCastlingRights"][1]*1]
-        return outVec
+    def one_hot_batch(self,boards,out=None):
+        """
+        Input:
+            boards: sequence of N boards
+            out: optional preallocated (N,772) array to fill in place
+        Returns:
+            outArray: (N,772) uint8 array whose rows are one_hot of each
+                      board, filled with a single scatter over the stacked
+                      Board.squareCodes
+        """
+        if out is None:
+            out = np.zeros((len(boards),772), dtype=np.uint8)
+        else:
+            out[:] = 0
+        if len(boards) == 0:
+            return out
+        codes = np.stack([board.squareCodes for board in boards])
+        (rows,squares) = np.nonzero(codes[:,:64] >= 0)
+        out[rows, 12*squares + PIECE_FEATURE_ARRAY[codes[rows,squares]]] = 1
+        out[:,768:772] = codes[:,64:]
+        return out
 
 
     # def getBoardSize(self):
@@ -86,16 +129,40 @@ class Game():
         Input:
             board: current board
             player: current player (1 or -1)
-            action: action taken by current player as a one-hot vector
+            action: action taken by current player, seen from the canonical
+                    form of board, as an action index or a one-hot vector
         Returns:
             nextBoard: board after applying action
             nextPlayer: player who plays in the next turn (should be -player)
         """
-        piece,newPosition = one_hot_to_move(action,board,player)
+        piece,newPosition = action_to_move(self.__action_index(action),board,player,True)
         nextBoard = board.execute_move(board,piece,newPosition,player)
         nextPlayer = -1*player
         return nextBoard, nextPlayer
 
+    def getNextCanonicalState(self, canonicalBoard, action):
+        """
+        Input:
+            canonicalBoard: current board in canonical form (player 1 to move)
+            action: action taken by player 1 as an action index or a one-hot
+                    vector
+        Returns:
+            nextBoard: canonical form of the board after applying action.
+                       The move is made and unmade in place on
+                       canonicalBoard, so only the flipped board is allocated.
+        """
+        piece,newPosition = action_to_move(self.__action_index(action),canonicalBoard,1,True)
+        canonicalBoard.make_move(Move(piece,newPosition))
+        nextBoard = self.getCanonicalForm(canonicalBoard, -1)
+        canonicalBoard.unmake_move()
+        return nextBoard
+
+    def __action_index(self, action):
+        """Accepts an action index or a one-hot action vector"""
+        if isinstance(action, np.ndarray) and action.ndim > 0:
+            return int(action.argmax())
+        return int(action)
+
     def getValidMoves(self, board, player):
         """
         Input:
@@ -107,10 +174,23 @@ class Game():
                         0 for invalid moves
         """
         validMoves = np.zeros((4096,))
-        for move in board.legal_moves(player):
-            validMoves = validMoves + move.one_hot()
+        validMoves[self.getValidActions(board, player)] = 1
         return validMoves
 
+    def getValidActions(self, board, player):
+        """
+        Input:
+            board: current board
+            player: current player
+        Returns:
+            validActions: sorted int16 array of the action indices of the
+                          moves that are valid from the current board and
+                          player (the nonzero entries of getValidMoves)
+        """
+        validActions = np.array([move.action() for move in board.legal_moves(player)], dtype=np.int16)
+        validActions.sort()
+        return validActions
+
     def getGameEnded(self, board, player):
         """
         Input:
@@ -121,24 +201,30 @@ class Game():
                small non-zero value for draw.
 
         """
-        turn = board.board["turn"]
-        if (board.legal_moves(turn) == []):
-            if (turn == 1):
-                kingPosition = board.board["whiteKing"]
-            else:
-                kingPosition = board.board["blackKing"]
-            if (board.is_in_check(board.board,kingPosition,turn)):
-                return -1*player*turn
-            else:
-                return 1e-12
-        elif (board.no_wins()):
-            return 1e-12
-        # elif (board.board["repetition"]):
-        #     return 1e-12
-        elif (board.repetition()):
-            return 1e-12
-        else:
-            return 0
+        return self.__player_result(board.outcome(), player)
+
+    def getPositionEnded(self, board, player):
+        """
+        As getGameEnded, but ignoring the draws by repetition and by the
+        fifty-move rule, so the result depends only on the position (its
+        pieces, castling and en passant rights and the player to move) and
+        can be cached by positionKey.
+        """
+        return self.__player_result(board.position_outcome(), player)
+
+    def isHistoryDraw(self, board):
+        """
+        Returns:
+            True if the game is drawn by threefold repetition or the
+            fifty-move rule, which depend on the moves played to reach board
+        """
+        return board.history_draw()
+
+    def __player_result(self, result, player):
+        """Turns a winner color into a result for player"""
+        if (result == 1) or (result == -1):
+            return result*player
+        return result
 
     def getCanonicalForm(self, board, player):
         """
@@ -157,38 +243,7 @@ class Game():
         if (player == 1):
             return board
         else:
-            canonicalBoard = {}
-            board = board.board
-            for square in board.keys():
-                if isinstance(square, tuple):
-                    oldPiece = board[square]
-                    piece = Piece(oldPiece.denomination,oldPiece.color,oldPiece.position)
-                    (oldRow,oldCol) = piece.position
-                    newRow = -oldRow + 7
-                    newCol = oldCol
-                    piece.color = -1*piece.color
-                    piece.position = (newRow,newCol)
-                    canonicalBoard[(newRow,newCol)] = piece
-            canonicalBoard["whiteCastlingRights"] = board["blackCastlingRights"]
-            canonicalBoard["blackCastlingRights"] = board["whiteCastlingRights"]
-            if board["enPassant"] != None:
-                (oldPassantRow,oldPassantCol) = board["enPassant"]
-                newPassantRow = -oldPassantRow + 7
-                newPassantCol = oldPassantCol
-                canonicalBoard["enPassant"] = (newPassantRow,newPassantCol)
-            else:
-                canonicalBoard["enPassant"] = None
-            (oldBKingRow,oldBKingCol) = board["blackKing"]
-            newWKingRow = -oldBKingRow + 7
-            newWKingCol = oldBKingCol
-            canonicalBoard["whiteKing"] = (newWKingRow,newWKingCol)
-            (oldWKingRow,oldWKingCol) = board["whiteKing"]
-            newBKingRow = -oldWKingRow + 7
-            newBKingCol = oldWKingCol
-            canonicalBoard["blackKing"] = (newBKingRow,newBKingCol)
-            canonicalBoard["recentMoves"] = board["recentMoves"]
-            canonicalBoard["turn"] = 1
-            return Board(canonicalBoard)
+            return board.mirror()
 
     def getSymmetries(self, board, pi):
         return [(board,pi)]
@@ -202,5 +257,16 @@ class Game():
             boardString: a quick conversion of board to a string format.
                          Required by MCTS for hashing.
         """
-        boardString = str(self.one_hot(board))
+        boardString = str(self.one_hot(board).tolist())
         return boardString
+
+    def positionKey(self, board):
+        """
+        Input:
+            board: current board
+        Returns:
+            key: 64-bit Zobrist key of board. Kept up to date as moves are
+                 made, so it is a much cheaper MCTS hash key than
+                 stringRepresentation.
+        """
+        return board.key
@@ -1,28 +1,147 @@
 import math
 import numpy as np
-from multiprocessing import Pool, Manager, cpu_count
-import functools
 EPS = 1e-8
-manager = Manager()
+MAX_DEPTH = 900     # longest path a simulation descends, scored as a draw
+
+class NodeStore():
+    """
+    Search tree held in flat NumPy arrays within the searching process.
+    Every position reached gets a node index, looked up by its position
+    key. Expanding a node appends one child entry per legal action, so the
+    children of a node are the contiguous block
+    firstChild[node]:firstChild[node]+childCount[node] of the child arrays.
+    """
+
+    def __init__(self, nodeCapacity=1024, childCapacity=32768):
+        self.nodeIndex = {}                                             # position key -> node index
+        self.nodeKeys = []                                              # position key of each node
+        self.numNodes = 0
+        self.ended = np.zeros(nodeCapacity, dtype=np.float64)          # game.getPositionEnded of node (0 if not ended)
+        self.firstChild = np.full(nodeCapacity, -1, dtype=np.int64)    # first child entry, -1 until expanded
+        self.childCount = np.zeros(nodeCapacity, dtype=np.int32)       # number of legal actions
+        self.visits = np.zeros(nodeCapacity, dtype=np.int64)           # Ns: #times node was visited after expansion
+
+        self.numChildren = 0
+        self.action = np.zeros(childCapacity, dtype=np.int16)          # action index of the edge
+        self.prior = np.zeros(childCapacity, dtype=np.float32)         # P: policy returned by the neural net
+        self.childVisits = np.zeros(childCapacity, dtype=np.int32)     # Nsa: #times edge was visited
+        self.valueSum = np.zeros(childCapacity, dtype=np.float64)      # W: Qsa = valueSum/childVisits
+        self.childNode = np.full(childCapacity, -1, dtype=np.int64)    # node reached by the edge, -1 until visited
+
+    def node(self, key):
+        """Returns the node index of the position key (None if not in the tree)"""
+        return self.nodeIndex.get(key)
+
+    def add(self, key, ended):
+        """Adds an unexpanded node for the position key and returns its index"""
+        if self.numNodes == len(self.ended):
+            self.__grow_nodes()
+        node = self.numNodes
+        self.numNodes += 1
+        self.nodeIndex[key] = node
+        self.nodeKeys.append(key)
+        self.ended[node] = ended
+        self.firstChild[node] = -1
+        self.childCount[node] = 0
+        self.visits[node] = 0
+        return node
+
+    def expand(self, node, actions, priors):
+        """Appends the children of node: its legal actions and their priors"""
+        count = len(actions)
+        while self.numChildren + count > len(self.action):
+            self.__grow_children()
+        first = self.numChildren
+        self.numChildren += count
+        self.firstChild[node] = first
+        self.childCount[node] = count
+        self.action[first:first+count] = actions
+        self.prior[first:first+count] = priors
+        self.childVisits[first:first+count] = 0
+        self.valueSum[first:first+count] = 0
+        self.childNode[first:first+count] = -1
+
+    def is_expanded(self, node):
+        return self.firstChild[node] >= 0
+
+    def children(self, node):
+        """Returns the slice of the child arrays holding the children of node"""
+        first = self.firstChild[node]
+        return slice(first, first + self.childCount[node])
+
+    def compact(self, root):
+        """
+        Keeps only root and the nodes reachable from it through visited
+        edges, renumbered in breadth first order (root becomes node 0), and
+        packs their children at the start of the child arrays. The space of
+        the dropped nodes is reused by later searches.
+        """
+        newNode = np.full(self.numNodes, -1, dtype=np.int64)
+        newNode[root] = 0
+        order = [root]
+        for node in order:
+            if self.firstChild[node] >= 0:
+                for child in self.childNode[self.children(node)].tolist():
+                    if child >= 0 and newNode[child] < 0:
+                        newNode[child] = len(order)
+                        order.append(child)
+        nodes = np.array(order, dtype=np.int64)
+        numNodes = len(nodes)
+        expanded = self.firstChild[nodes] >= 0
+        counts = np.where(expanded, self.childCount[nodes], 0)
+        blocks = [np.arange(self.firstChild[node], self.firstChild[node] + count) for (node, count) in zip(order, counts.tolist()) if count]
+        entries = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int64)
+        numChildren = len(entries)
+
+        self.firstChild[:numNodes] = np.where(expanded, np.cumsum(counts) - counts, -1)
+        self.childCount[:numNodes] = counts
+        self.ended[:numNodes] = self.ended[nodes]
+        self.visits[:numNodes] = self.visits[nodes]
+        self.action[:numChildren] = self.action[entries]
+        self.prior[:numChildren] = self.prior[entries]
+        self.childVisits[:numChildren] = self.childVisits[entries]
+        self.valueSum[:numChildren] = self.valueSum[entries]
+        childNode = self.childNode[entries]
+        self.childNode[:numChildren] = np.where(childNode >= 0, newNode[childNode], -1)
+        self.nodeKeys = [self.nodeKeys[node] for node in order]
+        self.nodeIndex = dict(zip(self.nodeKeys, range(numNodes)))
+        self.numNodes = numNodes
+        self.numChildren = numChildren
+
+    def clear(self):
+        """Removes every node"""
+        self.nodeIndex = {}
+        self.nodeKeys = []
+        self.numNodes = 0
+        self.numChildren = 0
+
+    def __grow_nodes(self):
+        capacity = 2*len(self.ended)
+        self.ended = np.resize(self.ended, capacity)
+        self.firstChild = np.resize(self.firstChild, capacity)
+        self.childCount = np.resize(self.childCount, capacity)
+        self.visits = np.resize(self.visits, capacity)
+
+    def __grow_children(self):
+        capacity = 2*len(self.action)
+        self.action = np.resize(self.action, capacity)
+        self.prior = np.resize(self.prior, capacity)
+        self.childVisits = np.resize(self.childVisits, capacity)
+        self.valueSum = np.resize(self.valueSum, capacity)
+        self.childNode = np.resize(self.childNode, capacity)
+
+
 class MCTS():
     """
     This class handles the MCTS tree.
     """
 
     def __init__(self, game, nnets, args):
-        manager = Manager()
         self.game = game
-        self.nnets = nnets
-        self.net_ind = manager.dict()
-        self.net_ind['ind'] = 0
+        self.nnets = nnets              # leaves are evaluated with nnets[0], the net Coach trains and syncs
         self.args = args
-        self.Qsa = manager.dict()       # stores Q values for s,a (as defined in the paper)
-        self.Nsa = manager.dict()       # stores #times edge s,a was visited
-        self.Ns = manager.dict()        # stores #times board s was visited
-        self.Ps = manager.dict()        # stores initial policy (returned by neural net)
-
-        # self.Es = {}        # stores game.getGameEnded ended for board s
-        # self.Vs = {}        # stores game.getValidMoves for board s
+        self.store = NodeStore()        # stores Ns, and Nsa, Qsa, P over the legal actions of every node
+        self.__allocate_paths(max(1, args.get('mctsBatchSize', 1)))
 
     def getActionProb(self, canonicalBoard, temp=1):
         """
@@ -32,15 +151,21 @@ class MCTS():
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
+        batchSize = self.args.get('mctsBatchSize', 1)
+        if batchSize > 1:
+            # expand the root alone, or every path of the first batch would stop at it
+            self.search(canonicalBoard)
+            for i in range(1, self.args['numMCTSSims'], batchSize):
+                self.searchBatch(canonicalBoard, min(batchSize, self.args['numMCTSSims'] - i))
+        else:
+            for i in range(self.args['numMCTSSims']):
+                self.search(canonicalBoard)
 
-        # now you share the model and graph between processes
-        # in each process you can call this:
-        with Pool(processes = cpu_count()) as p:
-            scores = [p.apply_async(self.search, (canonicalBoard,)) for i in range(self.args['numMCTSSims'])]
-            [s.get() for s in scores]
-
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa.get((s,a),0) for a in range(self.game.getActionSize())]
+        counts = np.zeros(self.game.getActionSize())
+        node = self.store.node(self.game.positionKey(canonicalBoard))
+        if node is not None and self.store.is_expanded(node):
+            children = self.store.children(node)
+            counts[self.store.action[children]] = self.store.childVisits[children]
 
         if temp==0:
             bestA = np.argmax(counts)
@@ -48,84 +173,163 @@ class MCTS():
             probs[bestA]=1
             return probs
 
-        counts = [x**(1./temp) for x in counts]
-        probs = [x/float(sum(counts)) for x in counts]
-        return probs
+        counts = counts**(1./temp)
+        probs = counts/float(counts.sum())
+        return probs.tolist()
+
+    def advance(self, canonicalBoard):
+        """
+        Makes canonicalBoard, the position reached after the moves played
+        since the last search, the root of the tree: its subtree is kept
+        with all its statistics and the rest of the tree is freed. The tree
+        is cleared if the position was never reached by the search.
+        """
+        root = self.store.node(self.game.positionKey(canonicalBoard))
+        if root is None:
+            self.store.clear()
+        else:
+            self.store.compact(root)
 
-    def search(self, canonicalBoard,recursionDepth=0):
+    def search(self, canonicalBoard):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        This function performs one iteration of MCTS. It descends from
+        canonicalBoard till a leaf node is found, taking at each node the
+        action with the maximum upper confidence bound as in the paper and
+        recording the path in a preallocated stack.
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propogated
         up the search path. In case the leaf node is a terminal state, the
         outcome is propogated up the search path. The values of Ns, Nsa, Qsa are
         updated.
-        NOTE: the return values are the negative of the value of the current
-        state. This is done since v is in [-1,1] and if v is the value of a
-        state for the current player, then its value is -v for the other player.
+        NOTE: the value is negated at every step up the path, since v is in
+        [-1,1] and if v is the value of a state for the current player, then
+        its value is -v for the other player.
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
-        recursionDepth += 1
-        s = self.game.stringRepresentation(canonicalBoard)
-
-        Es = self.game.getGameEnded(canonicalBoard, 1)
-        if Es!=0:
-            return -Es
-
-        if s not in self.Ps:
+        (board, node, depth, v) = self.__descend(canonicalBoard, 0, 0)
+        if v is None:
             # leaf node
-            prev_net_ind = self.net_ind['ind']
-            self.net_ind['ind'] = (self.net_ind['ind'] + 1) % 4
-            self.Ps[s], v = self.nnets[prev_net_ind].predict(self.game.one_hot(canonicalBoard))
-            valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = np.multiply(self.Ps[s],valids)     # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s    # renormalize
+            pi, v = self.nnets[0].predict(self.game.one_hot(board))
+            self.__expand(node, board, pi)
+        self.__backup(0, depth, v, 0)
+        return v if depth % 2 else -v
+
+    def searchBatch(self, canonicalBoard, batchSize):
+        """
+        Performs batchSize iterations of MCTS at once. Each path is descended
+        from canonicalBoard as in search, adding a virtual loss (a visit
+        valued as a loss) to every edge it takes so that later paths of the
+        batch spread to other branches. The leaves reached are then
+        evaluated with a single predict_batch call, and the virtual losses
+        are replaced by the backed up values.
+        """
+        store = self.store
+        virtualLoss = self.args.get('virtualLoss', 1)
+        if batchSize > len(self.pathChildren):
+            self.__allocate_paths(batchSize)
+        leaves = []
+        for row in range(batchSize):
+            (board, node, depth, v) = self.__descend(canonicalBoard, row, virtualLoss)
+            if v is None:
+                # leaf node, evaluated with the rest of the batch
+                leaves.append((row, board, node, depth))
             else:
-                # if all valid moves were masked make all valid moves equally probable
-
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
-                print("All valid moves were masked, do workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            self.Ns[s] = 0
-            return -v
-
-        valids = self.game.getValidMoves(canonicalBoard, 1)
-        cur_best = -float('inf')
-        best_act = -1
-
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s,a) in self.Qsa:
-                    u = self.Qsa.get((s,a),0) + self.args['cpuct']*self.Ps.get(s,[0]*4096)[a]*math.sqrt(self.Ns.get(s,0))/(1+self.Nsa.get((s,a),0))
-                else:
-                    u = self.args['cpuct']*self.Ps.get(s,[0]*4096)[a]*math.sqrt(self.Ns.get(s,0) + EPS)     # Q = 0 ?
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-
-        a = best_act
-        onehot_a = np.zeros((4096,))
-        onehot_a[a] = 1
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, onehot_a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
-
-        if (recursionDepth<900):
-            v = self.search(next_s,recursionDepth)
+                self.__backup(row, depth, v, virtualLoss)
+
+        if leaves:
+            pis, vs = self.nnets[0].predict_batch(self.game.one_hot_batch([board for (row, board, node, depth) in leaves]))
+            for ((row, board, node, depth), pi, v) in zip(leaves, pis, vs):
+                if not store.is_expanded(node):     # paths may share a leaf
+                    self.__expand(node, board, pi)
+                self.__backup(row, depth, v, virtualLoss)
+
+    def __allocate_paths(self, rows):
+        """Preallocates rows search paths of (node, child entry) pairs"""
+        self.pathNodes = np.zeros((rows, MAX_DEPTH), dtype=np.int64)
+        self.pathChildren = np.zeros((rows, MAX_DEPTH), dtype=np.int64)
+
+    def __descend(self, canonicalBoard, row, virtualLoss):
+        """
+        Walks down the tree from canonicalBoard, storing the path in row of
+        the path stack and counting a visit (plus virtualLoss) on every edge
+        (the visits of the nodes passed are counted by __backup).
+        Returns:
+            (board, node, depth, v): the last position reached, its node, the
+            path length and its value: the game result for a terminal node,
+            a draw when MAX_DEPTH is reached and None for a leaf to evaluate
+        """
+        store = self.store
+        pathNodes = self.pathNodes[row]
+        pathChildren = self.pathChildren[row]
+        board = canonicalBoard
+        depth = 0
+        while True:
+            s = self.game.positionKey(board)
+            node = store.node(s)
+            if node is None:
+                node = store.add(s, self.game.getPositionEnded(board, 1))
+            if depth:
+                store.childNode[pathChildren[depth-1]] = node
+            if store.ended[node]!=0:
+                # terminal node
+                return (board, node, depth, store.ended[node])
+            if self.game.isHistoryDraw(board):
+                # drawn by the moves that led here, which the node key does
+                # not cover, so checked on the board at every visit
+                return (board, node, depth, 1e-12)
+            if not store.is_expanded(node):
+                return (board, node, depth, None)
+            if depth == MAX_DEPTH:
+                return (board, node, depth, 1e-12)
+            child = self.__select(node)
+            store.childVisits[child] += 1
+            store.valueSum[child] -= virtualLoss
+            pathNodes[depth] = node
+            pathChildren[depth] = child
+            depth += 1
+            board = self.game.getNextCanonicalState(board, int(store.action[child]))
+
+    def __expand(self, node, canonicalBoard, pi):
+        """Stores the children of a leaf node with the priors of policy pi
+        over its valid actions"""
+        valids = self.game.getValidActions(canonicalBoard, 1)
+        priors = pi[valids]     # masking invalid moves, aligned with valids
+        sum_Ps_s = np.sum(priors)
+        if sum_Ps_s > 0:
+            priors /= sum_Ps_s    # renormalize
         else:
-            v = 1e-12
+            # if all valid moves were masked make all valid moves equally probable
+
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
+            print("All valid moves were masked, do workaround.")
+            priors = np.ones(len(valids))/len(valids)
+        self.store.expand(node, valids, priors)
 
-        self.Qsa[(s,a)] = (self.Nsa.get((s,a),0)*self.Qsa.get((s,a),0) + v)/(self.Nsa.get((s,a),0)+1)
-        self.Nsa[(s,a)] = self.Nsa.get((s,a),0) + 1
+    def __select(self, node):
+        """Returns the child entry of node with the highest upper confidence
+        bound, computed over all its legal actions at once"""
+        store = self.store
+        children = store.children(node)
+        Ns = store.visits[node]
+        Nsa = store.childVisits[children]
+        cpuctP = self.args['cpuct']*store.prior[children]
+        u = np.where(Nsa > 0,
+            store.valueSum[children]/np.maximum(Nsa, 1) + cpuctP*math.sqrt(Ns)/(1+Nsa),
+            cpuctP*math.sqrt(Ns + EPS))     # Q = 0 for unvisited actions
+        return children.start + int(np.argmax(u))
 
-        self.Ns[s] = self.Ns.get(s,0) + 1
-        return -v
+    def __backup(self, row, depth, v, virtualLoss):
+        """Adds the leaf value v (for the player to move at the leaf) to the
+        depth edges stored in row of the path stack, whose visits were
+        counted during the descent along with virtualLoss, and counts a
+        visit of every node they leave from"""
+        store = self.store
+        pathNodes = self.pathNodes[row]
+        pathChildren = self.pathChildren[row]
+        v = -v
+        for i in range(depth-1, -1, -1):
+            store.valueSum[pathChildren[i]] += v + virtualLoss
+            store.visits[pathNodes[i]] += 1
+            v = -v
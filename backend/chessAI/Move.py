@@ -1,10 +1,34 @@
 import numpy as np
 
+PROMOTION = 1 << 12 # Flag bit of a packed move that promotes a pawn (always to a queen)
+
+def encode_move(oldPosition,newPosition,promotion=False):
+    """ Packs a move into a 16 bit integer: the from square in bits 6-11,
+    the to square in bits 0-5 and the promotion flag in bit 12. Squares
+    are numbered row*8+col, so the low 12 bits are the action index
+    64*from + to. """
+    (oldRow,oldCol) = oldPosition
+    (newRow,newCol) = newPosition
+    code = ((oldRow*8+oldCol) << 6) | (newRow*8+newCol)
+    if promotion:
+        code |= PROMOTION
+    return int(code)
+
+def action_to_squares(action):
+    """ Returns the (from, to) squares of an action index (or packed move) """
+    (oldSquare,newSquare) = divmod(int(action) & 0xFFF, 64)
+    return divmod(oldSquare, 8),divmod(newSquare, 8)
+
 class Move(object):
-    """docstring for Move."""
+    """A piece together with the square it moves to, also packed into
+    a 16 bit integer code (see encode_move)."""
+    __slots__ = ("piece", "newSquare", "code")
+
     def __init__(self,piece,square):
         self.piece = piece
         self.newSquare = square
+        promotion = (piece.denomination == "Pawn") and (square[0] == 0 or square[0] == 7)
+        self.code = encode_move(piece.position,square,promotion)
 
     def one_hot(self):
         """ There will be a one hot vector used to represent
@@ -15,25 +39,26 @@ class Move(object):
         This function puts a 1 in the coordinate corresponding
         to moving the piece provided to the square provided. """
         outVec = np.zeros((4096,))
-        (newRow,newCol) = self.newSquare
-        (oldRow,oldCol) = self.piece.position
-        ind = 64*(oldRow*8+oldCol) + (newRow*8+newCol)
-        outVec[int(ind)] = 1
+        outVec[self.action()] = 1
         return outVec
 
+    def action(self):
+        """Index of the 1 in the one hot representation of this move"""
+        return self.code & 0xFFF
 
-def one_hot_to_move(onehot,board,player_color,inCanonicalForm):
+
+def action_to_move(action,board,player_color,inCanonicalForm):
     """ The following function returns the corresponding move
-    from the one hot representation given the current board
-    state. """
-    board = board.board
-    ind = onehot.argmax()
-    newCol = ind%8
-    newRow = (ind%64-newCol)/8
-    oldCol = ((ind - (newRow*8+newCol))/64)%8
-    oldRow = (((ind - (newRow*8+newCol))/64)-oldCol)/8
+    from the action index given the current board state. """
+    (oldRow,oldCol),(newRow,newCol) = action_to_squares(action)
     if (player_color == -1 and inCanonicalForm):
         oldRow = -oldRow + 7
         newRow = -newRow + 7
-    piece = board[(oldRow,oldCol)]
+    piece = board.board[(oldRow,oldCol)]
     return piece,(newRow,newCol)
+
+def one_hot_to_move(onehot,board,player_color,inCanonicalForm):
+    """ The following function returns the corresponding move
+    from the one hot representation given the current board
+    state. """
+    return action_to_move(onehot.argmax(),board,player_color,inCanonicalForm)
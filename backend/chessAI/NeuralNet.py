@@ -4,7 +4,9 @@ from keras.optimizers import Adam
 from keras.losses import mean_squared_error, categorical_crossentropy
 from keras import regularizers
 import keras.backend as K
+from keras.utils import Sequence
 import numpy as np
+import math
 import os
 from multiprocessing.managers import BaseManager
 import tensorflow as tf
@@ -100,17 +102,14 @@ class NeuralNet():
         This function trains the neural network with examples obtained from
         self-play.
         Input:
-            examples: a list of training examples, where each example is of form
-                      (board, pi, v). pi is the MCTS informed policy vector for
-                      the given board, and v is its value. The examples has
-                      board in its canonical form.
+            examples: an Examples.ExampleSet of compact training examples
+                      (board, policy, v), where policy holds the nonzero
+                      entries of the MCTS informed policy vector for the
+                      given board, and v is its value. The examples has
+                      board in its canonical form. They are expanded to
+                      dense arrays one batch at a time.
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = (np.asarray(input_boards))
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs).reshape((len(target_vs),1))
-        target_y = (np.concatenate((target_vs,target_pis),axis=1))
-        self.nnet.fit(x = input_boards, y = target_y, batch_size = 64, epochs = n_epochs)
+        self.nnet.fit_generator(ExampleSequence(examples, batch_size = 64), epochs = n_epochs, shuffle = True)
 
     def predict(self, board):
         """
@@ -121,13 +120,26 @@ class NeuralNet():
                 game.getActionSize
             z: a float in [-1,1] that gives the value of the current board
         """
-        board = np.array(board).reshape(1,772)
+        board = np.asarray(board, dtype=np.float32).reshape(1,772)
         with self.graph.as_default():
             v = self.nnet.predict(board)
         z = v[0][0]
         pi = v[0][1:4097]
         return pi,z
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: (N,772) array of boards in their canonical form
+        Returns:
+            pis: (N,game.getActionSize) array of policy vectors
+            zs: N values in [-1,1], one for each board
+        """
+        boards = np.asarray(boards, dtype=np.float32).reshape(-1,772)
+        with self.graph.as_default():
+            v = self.nnet.predict(boards, batch_size=len(boards))
+        return v[:,1:4097], v[:,0]
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         filepath = os.path.join(folder, filename)
         if not os.path.exists(folder):
@@ -144,6 +156,19 @@ class NeuralNet():
         self.nnet.load_weights(filepath)
         print('loaded weights')
 
+class ExampleSequence(Sequence):
+    """Feeds an ExampleSet to Keras, expanding each batch (a slice of its
+    records) to dense inputs and targets only when it is requested"""
+    def __init__(self, examples, batch_size):
+        self.examples = examples
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return int(math.ceil(len(self.examples)/float(self.batch_size)))
+
+    def __getitem__(self, idx):
+        return self.examples[idx*self.batch_size:(idx+1)*self.batch_size].expand()
+
 class KerasManager(BaseManager):
     pass
 
@@ -1,160 +1,175 @@
 import numpy as np
 
+def _target_table(offsets):
+    """Maps every square to the on-board squares reached by the given offsets"""
+    table = {}
+    for row in range(8):
+        for col in range(8):
+            table[(row,col)] = tuple([(row+v1,col+v2) for (v1,v2) in offsets if (0 <= row+v1 < 8) and (0 <= col+v2 < 8)])
+    return table
+
+# Built once at import: move targets of knights and kings and capture targets
+# of pawns (indexed by color) for each of the 64 squares
+KNIGHT_TARGETS = _target_table([ (1,2), (-1,2), (1,-2), (-1,-2), (2,1), (-2,1), (2,-1), (-2,-1) ])
+KING_TARGETS = _target_table([ (1,1), (1,-1), (-1,1), (-1,-1), (0,1), (0,-1), (1,0), (-1,0) ])
+PAWN_ATTACKS = { 1: _target_table([ (-1,1), (-1,-1) ])
+    , -1: _target_table([ (1,1), (1,-1) ])
+    }
+
+def _ray_table(directions):
+    """Maps every square to one ray per direction, each ray listing the
+    squares from the nearest to the board edge"""
+    table = {}
+    for row in range(8):
+        for col in range(8):
+            rays = []
+            for (v1,v2) in directions:
+                ray = []
+                (r,c) = (row+v1,col+v2)
+                while (0 <= r < 8) and (0 <= c < 8):
+                    ray.append((r,c))
+                    (r,c) = (r+v1,c+v2)
+                if ray:
+                    rays.append(tuple(ray))
+            table[(row,col)] = tuple(rays)
+    return table
+
+ROOK_RAYS = _ray_table([ (1,0), (-1,0), (0,1), (0,-1) ])
+BISHOP_RAYS = _ray_table([ (1,1), (-1,1), (1,-1), (-1,-1) ])
+QUEEN_RAYS = dict((square, ROOK_RAYS[square] + BISHOP_RAYS[square]) for square in ROOK_RAYS)
+
+DENOMINATIONS = ["Pawn", "Knight", "Bishop", "Rook", "Queen", "King"]
+FEN_LETTERS = "PNBRQKpnbrqk" # FEN letter of each Piece.code
+
+def square_name(position):
+    """Algebraic name of a (row,col) square, e.g. (7,4) is e1"""
+    (row,col) = position
+    return "abcdefgh"[col] + str(8-row)
+
+def parse_square(name):
+    """(row,col) square of an algebraic square name"""
+    return (8-int(name[1]), "abcdefgh".index(name[0]))
+
 class Piece(object):
-    """This class defines a chess piece"""
-    def __init__(self,denomination,color,position):
+    """This class defines a chess piece. Pieces are immutable flyweights:
+    there is one shared instance per denomination, color and position,
+    so boards can share them and creating one is a dict lookup."""
+    __slots__ = ("denomination", "color", "position", "code", "_flipped")
+    __instances = {}
+
+    def __new__(cls,denomination,color,position):
         """denomination: String representing denomination of piece
         color: 1 if White, -1 if Black
         position: Tuple with current position of piece on board """
-        self.denomination = denomination
-        self.color = color
-        self.position = position
+        piece = cls.__instances.get((denomination,color,position))
+        if piece is None:
+            piece = object.__new__(cls)
+            piece.denomination = denomination
+            piece.color = color
+            piece.position = position
+            # Small integer code: 0-5 white Pawn..King, 6-11 black Pawn..King
+            piece.code = DENOMINATIONS.index(denomination) + (0 if color == 1 else 6)
+            piece._flipped = None
+            cls.__instances[(denomination,color,position)] = piece
+        return piece
+
+    def __reduce__(self):
+        """Unpickled pieces are looked up in the shared instances again"""
+        return (Piece, (self.denomination, self.color, self.position))
+
+    def flip(self):
+        """Returns the piece of the other color on the square mirrored
+        across the middle of the board (looked up once, then kept)"""
+        if self._flipped is None:
+            (row,col) = self.position
+            self._flipped = Piece(self.denomination,-1*self.color,(7-row,col))
+        return self._flipped
 
     def moves(self,board):
         """Returns list of moves for any given piece
         according to only how basic piece movement rules work
         (not accounting for moves that depend on other piece positions, like
         moving into checks or castling)"""
-        movesByPiece = { "Pawn": self.__pawn_moves
-        , "Knight": self.__knight_moves
-        , "Bishop": self.__bishop_moves
-        , "Rook": self.__rook_moves
-        , "Queen": self.__queen_moves
-        , "King": self.__king_moves
-       }
-        return movesByPiece[self.denomination](board)
+        return self.__movesByPiece[self.denomination](self,board)
 
     def one_hot(self):
-        oneHotPiece = { "WhitePawn": [1,0,0,0,0,0,0,0,0,0,0,0]
-        , "WhiteKnight":[0,1,0,0,0,0,0,0,0,0,0,0]
-        , "WhiteBishop":[0,0,1,0,0,0,0,0,0,0,0,0]
-        , "WhiteRook":[0,0,0,1,0,0,0,0,0,0,0,0]
-        , "WhiteQueen":[0,0,0,0,1,0,0,0,0,0,0,0]
-        , "WhiteKing":[0,0,0,0,0,0,1,0,0,0,0,0]
-        , "BlackPawn": [0,0,0,0,0,0,1,0,0,0,0,0]
-        , "BlackKnight":[0,0,0,0,0,0,0,1,0,0,0,0]
-        , "BlackBishop":[0,0,0,0,0,0,0,0,1,0,0,0]
-        , "BlackRook":[0,0,0,0,0,0,0,0,0,1,0,0]
-        , "BlackQueen":[0,0,0,0,0,0,0,0,0,0,1,0]
-        , "BlackKing":[0,0,0,0,0,0,0,0,0,0,0,1]
-        }
-        if (self.color == 1):
-            color = "White"
-        else:
-            color = "Black"
-        outVec = oneHotPiece[color + self.denomination]
-        return outVec
+        """Returns a new list of the 12 piece features (the shared table
+        entries are never handed out, so callers may modify the result)"""
+        return list(self.__oneHotPiece[(self.color,self.denomination)])
 
 
-    def __clear_path(self,direction,board,currentSquare,pieceColor,path):
-        """Checks for path of empty/ capturable squares in a direction
+    def __ray_moves(self,board,rays):
+        """Scans each fixed ray outwards for empty/ capturable squares
         for queen/rook/bishop moves"""
-        (v1,v2) = direction
-        (row,col) = currentSquare
-        occupied = board.keys()
-        if (not ((row+v1 in range(8)) and (col+v2 in range(8)))):
-            return path
-        else:
-            if (row+v1 ,col+v2) in occupied:
-                if (board[(row+v1 ,col+v2)].color == pieceColor):
-                    return path
-                else:
-                    path.append((row+v1 ,col+v2))
-                    return path
-            else:
-                path.append((row+v1 ,col+v2))
-                return self.__clear_path(direction,board,(row+v1 ,col+v2),pieceColor,path)
+        color = self.color
+        possible = []
+        for ray in rays:
+            for square in ray:
+                if square in board:
+                    if (board[square].color != color):
+                        possible.append(square)
+                    break
+                possible.append(square)
+        return possible
 
     def __pawn_moves(self,board):
-        enPassant = board["enPassant"]
-        possible = []
         (row,col) = self.position
-        occupied = board.keys()
         color = self.color
-        if (color == 1):
-            if (row == 6 ):
-                if ((row-1,col) in occupied):
-                    possible = (possible
-                        + list(filter(lambda x: ( (x in occupied) and (board[x].color != color) ),[(row-1,col+1),(row-1,col-1)])))
-                else:
-                    possible = (possible
-                        + list(filter(lambda x: (not x in occupied ),[(row-1,col),(row-2,col)]))
-                        + list(filter(lambda x: ( (x in occupied) and (board[x].color != color) ),[(row-1,col+1),(row-1,col-1)])))
-            else:
-                possible = (possible
-                    + list(filter(lambda x: (not x in occupied ),[(row-1,col)]))
-                    + list(filter(lambda x: ( (x in occupied) and (board[x].color != color) ),[(row-1,col+1),(row-1,col-1)])))
-            if (enPassant in [(row-1,col+1),(row-1,col-1)]):
-                possible.append(enPassant)
-        else:
-            if (row == 1):
-                if ((row+1,col) in occupied):
-                    possible = (possible
-                        + list(filter(lambda x: ( (x in occupied) and (board[x].color != color) ),[(row+1,col+1),(row+1,col-1)])))
-                else:
-                    possible = (possible
-                        + list(filter(lambda x: (not x in occupied ),[(row+1,col),(row+2,col)]))
-                        + list(filter(lambda x: ( (x in occupied) and (board[x].color != color) ),[(row+1,col+1),(row+1,col-1)])))
-            else:
-                possible = (possible
-                    + list(filter(lambda x: (not x in occupied ),[(row+1,col)]))
-                    + list(filter(lambda x: ( (x in occupied) and (board[x].color != color) ),[(row+1,col+1),(row+1,col-1)])))
-            if (enPassant in [(row+1,col+1),(row+1,col-1)]):
-                possible.append(enPassant)
+        forward = (row-color,col)
+        possible = []
+        if not (forward in board):
+            possible.append(forward)
+            if (row == 6 and color == 1) or (row == 1 and color == -1):
+                doubleForward = (row-2*color,col)
+                if not (doubleForward in board):
+                    possible.append(doubleForward)
+        enPassant = board["enPassant"]
+        for square in PAWN_ATTACKS[color][self.position]:
+            if square in board:
+                if (board[square].color != color):
+                    possible.append(square)
+            elif (square == enPassant):
+                possible.append(square)
         return possible
 
     def __knight_moves(self,board):
-        possible = []
-        (row,col) = self.position
         color = self.color
-        occupied = board.keys()
-        options = [ (row+1,col+2), (row-1,col+2), (row+1,col-2), (row-1,col-2), (row+2,col+1), (row-2,col+1), (row+2,col-1), (row-2,col-1) ]
-        for move in options:
-            if move in occupied:
-                if (board[move].color == color):
-                    pass
-                else:
-                    possible.append(move)
-            else:
-                if (move[0] in range(8) and move[1] in range(8)):
-                    possible.append(move)
-                else:
-                    pass
-        return possible
+        return [square for square in KNIGHT_TARGETS[self.position] if (not (square in board)) or (board[square].color != color)]
 
 
     def __bishop_moves(self,board):
-        (row,col) = self.position
-        color = self.color
-        possible = self.__clear_path((1,1),board,(row,col),color,[]) + self.__clear_path((-1,1),board,(row,col),color,[]) + self.__clear_path((1,-1),board,(row,col),color,[]) + self.__clear_path((-1,-1),board,(row,col),color,[])
-        return possible
+        return self.__ray_moves(board,BISHOP_RAYS[self.position])
 
 
     def __rook_moves(self,board):
-        (row,col) = self.position
-        color = self.color
-        possible = self.__clear_path((1,0),board,(row,col),color,[]) + self.__clear_path((-1,0),board,(row,col),color,[]) + self.__clear_path((0,1),board,(row,col),color,[]) + self.__clear_path((0,-1),board,(row,col),color,[])
-        return possible
+        return self.__ray_moves(board,ROOK_RAYS[self.position])
 
     def __queen_moves(self,board):
-        return list(set(self.__rook_moves(board)+self.__bishop_moves(board)))
+        return self.__ray_moves(board,QUEEN_RAYS[self.position])
 
 
     def __king_moves(self,board):
-        possible = []
-        (row,col) = self.position
         color = self.color
-        occupied = board.keys()
-        options =  [ (row+1,col+1), (row+1,col-1), (row-1,col+1), (row-1,col-1), (row,col+1), (row,col-1), (row+1,col), (row-1,col) ]
-        for move in options:
-            if move in occupied:
-                if (board[move].color == self.color):
-                    pass
-                else:
-                    possible.append(move)
-            else:
-                if (move[0] in range(8) and move[1] in range(8)):
-                    possible.append(move)
-                else:
-                    pass
-        return possible
+        return [square for square in KING_TARGETS[self.position] if (not (square in board)) or (board[square].color != color)]
+
+    __movesByPiece = { "Pawn": __pawn_moves
+        , "Knight": __knight_moves
+        , "Bishop": __bishop_moves
+        , "Rook": __rook_moves
+        , "Queen": __queen_moves
+        , "King": __king_moves
+        }
+
+    __oneHotPiece = { (1,"Pawn"): [1,0,0,0,0,0,0,0,0,0,0,0]
+        , (1,"Knight"):[0,1,0,0,0,0,0,0,0,0,0,0]
+        , (1,"Bishop"):[0,0,1,0,0,0,0,0,0,0,0,0]
+        , (1,"Rook"):[0,0,0,1,0,0,0,0,0,0,0,0]
+        , (1,"Queen"):[0,0,0,0,1,0,0,0,0,0,0,0]
+        , (1,"King"):[0,0,0,0,0,0,1,0,0,0,0,0]
+        , (-1,"Pawn"): [0,0,0,0,0,0,1,0,0,0,0,0]
+        , (-1,"Knight"):[0,0,0,0,0,0,0,1,0,0,0,0]
+        , (-1,"Bishop"):[0,0,0,0,0,0,0,0,1,0,0,0]
+        , (-1,"Rook"):[0,0,0,0,0,0,0,0,0,1,0,0]
+        , (-1,"Queen"):[0,0,0,0,0,0,0,0,0,0,1,0]
+        , (-1,"King"):[0,0,0,0,0,0,0,0,0,0,0,1]
+        }
@@ -0,0 +1,135 @@
+"""Rules shared by Board and BitBoard: the game result, the material count
+and the draws that depend on the moves played (threefold repetition and the
+fifty-move rule), written once against the hooks listed in PositionMixin.
+"""
+
+# Material value of each denomination, indexed as Piece.code % 6
+PIECE_VALUES = [1, 3, 3, 5, 9, 0]
+
+def parse_move_clocks(fields):
+    """Returns the (halfmove clock, fullmove number) of the whitespace split
+    FEN fields (0 and 1 if not given)"""
+    halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+    fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+    return (halfmoveClock, fullmoveNumber)
+
+
+class PositionMixin(object):
+    """
+    Subclasses provide:
+        key, mirrorKey: Zobrist keys of the position and of its color
+                        flipped board, kept up to date as moves are made
+        material: number of pieces of each Piece.code
+        derived: dict of values cached until the next move
+        _turn(): 1 if white is to move, -1 if black
+        _legal_moves(player): list of the legal moves of player
+        _in_check(): True if the player to move is in check
+    and keep history, halfmoveClock and fullmoveNumber with _init_history,
+    _record_move and _unrecord_move.
+    """
+    def legal_moves(self,player):
+        """Returns a list of all legal moves for the current game state.
+        The list is computed once per position and player, then reused."""
+        if not (player in self.derived):
+            self.derived[player] = self._legal_moves(player)
+        return self.derived[player]
+
+    def in_check(self):
+        """Returns True if the player to move is in check (cached)"""
+        if not ("inCheck" in self.derived):
+            self.derived["inCheck"] = self._in_check()
+        return self.derived["inCheck"]
+
+    def outcome(self):
+        """Returns the game result: 0 if the game has not ended, the color
+        of the winner after checkmate and 1e-12 for a draw"""
+        result = self.position_outcome()
+        if (result == 0) and self.history_draw():
+            return 1e-12
+        return result
+
+    def position_outcome(self):
+        """Returns the result (cached) decided by the position alone, as
+        outcome but without the draws that depend on the moves played
+        (checkmate, stalemate and insufficient material only)"""
+        if not ("outcome" in self.derived):
+            turn = self._turn()
+            if (self.legal_moves(turn) == []):
+                if self.in_check():
+                    result = -1*turn
+                else:
+                    result = 1e-12
+            elif self.no_wins():
+                result = 1e-12
+            else:
+                result = 0
+            self.derived["outcome"] = result
+        return self.derived["outcome"]
+
+    def history_draw(self):
+        """Returns True if the game is drawn by threefold repetition or by
+        the fifty-move rule"""
+        return self.repetition(3) or (self.halfmoveClock >= 100)
+
+    def no_wins(self):
+        """Returns True if neither side has the material left to checkmate:
+        no pawns, rooks or queens and at most one minor piece each"""
+        (wPawn,wKnight,wBishop,wRook,wQueen,wKing,bPawn,bKnight,bBishop,bRook,bQueen,bKing) = self.material
+        if (wPawn or wRook or wQueen or bPawn or bRook or bQueen):
+            return False
+        return (wKnight + wBishop <= 1) and (bKnight + bBishop <= 1)
+
+    def material_balance(self):
+        """Returns white's material minus black's in pawn units"""
+        material = self.material
+        return sum([PIECE_VALUES[code]*(material[code] - material[code+6]) for code in range(6)])
+
+    def repetition(self,times=2):
+        """Returns True if the current position has occurred at least times
+        times (with the same side to move, castling and en passant rights)"""
+        return self.history[self._history_key()] >= times
+
+    def _history_key(self):
+        """Zobrist key of the position as seen with white to move, so a board
+        and its mirror share their history"""
+        if (self._turn() == 1):
+            return self.key
+        return self.mirrorKey
+
+    def _init_history(self,history,halfmoveClock,fullmoveNumber):
+        """Sets the occurrences of each position since the last pawn move or
+        capture, keyed as _history_key (only this position if history is
+        None), the number of moves played since then and the FEN fullmove
+        number"""
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        if history is None:
+            history = {self._history_key(): 1}
+        self.history = history
+
+    def _record_move(self,irreversible):
+        """Counts the position reached by a move, once key, mirrorKey and the
+        turn are updated. Pawn moves and captures are irreversible, so
+        earlier positions cannot repeat afterwards."""
+        if (self._turn() == 1):
+            self.fullmoveNumber += 1
+        if irreversible:
+            self.halfmoveClock = 0
+            self.history = {self._history_key(): 1}
+        else:
+            self.halfmoveClock += 1
+            historyKey = self._history_key()
+            self.history[historyKey] = self.history.get(historyKey,0) + 1
+
+    def _unrecord_move(self,history,halfmoveClock,fullmoveNumber):
+        """Restores the history and clocks saved before the last move, before
+        the key and turn are restored"""
+        if self.history is history:
+            historyKey = self._history_key()
+            if (history[historyKey] == 1):
+                del history[historyKey]
+            else:
+                history[historyKey] -= 1
+        self.history = history
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
@@ -0,0 +1,79 @@
+"""Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+Used to check the move generator against known node counts and to
+measure its throughput.
+
+Usage (from the backend directory):
+    python -m chessAI.perft DEPTH [--divide] [--bitboard] [--fen FEN]
+
+Note that pawns always promote to a queen in this engine, so counts only
+match the published perft tables while no promotions are reachable.
+"""
+import argparse
+import time
+from chessAI.Board import Board, START_FEN
+from chessAI.BitBoard import BitBoard
+
+
+def _turn(board):
+    if isinstance(board, BitBoard):
+        return board.turn
+    return board.board["turn"]
+
+def perft(board, depth):
+    """Returns the number of positions reached after depth plies from board.
+    Moves are made and unmade in place, so board is left unchanged."""
+    if depth == 0:
+        return 1
+    moves = board.legal_moves(_turn(board))
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth-1)
+        board.unmake_move()
+    return nodes
+
+def divide(board, depth):
+    """Returns a list of (move, nodes) pairs giving the perft count of
+    depth-1 below each legal move of board"""
+    counts = []
+    for move in board.legal_moves(_turn(board)):
+        board.make_move(move)
+        counts.append((move, perft(board, depth-1)))
+        board.unmake_move()
+    return counts
+
+def _move_name(move):
+    (oldRow,oldCol) = move.piece.position
+    (newRow,newCol) = move.newSquare
+    return "abcdefgh"[int(oldCol)] + str(8-int(oldRow)) + "abcdefgh"[int(newCol)] + str(8-int(newRow))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move generator leaf nodes to a fixed depth")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--bitboard", action="store_true", help="use the BitBoard backend")
+    parser.add_argument("--fen", default=START_FEN, help="position to search (default: the initial position)")
+    args = parser.parse_args(argv)
+
+    if args.bitboard:
+        board = BitBoard.from_fen(args.fen)
+    else:
+        board = Board.from_fen(args.fen)
+
+    start = time.time()
+    if args.divide:
+        counts = divide(board, args.depth)
+        for (move,nodes) in sorted(counts, key=lambda count: _move_name(count[0])):
+            print("%s: %d" % (_move_name(move), nodes))
+        nodes = sum([nodes for (move,nodes) in counts])
+    else:
+        nodes = perft(board, args.depth)
+    elapsed = time.time() - start
+    print("Nodes: %d" % nodes)
+    print("Time: %.3fs" % elapsed)
+    print("Nodes/s: %.0f" % (nodes/max(elapsed, 1e-9)))
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,16 @@ import websockets
 import json
 import numpy as np
 from chessAI.Piece import Piece
-from chessAI.Board import Board
+from chessAI.Board import Board, is_valid_fen
 from chessAI.Game import Game
 from chessAI.NeuralNet import NeuralNet as nn
-from chessAI.Move import one_hot_to_move
+from chessAI.Move import action_to_move
 from chessAI.MCTS import MCTS
 
 args = {
     'maxlenOfQueue': 200000,
     'numMCTSSims': 15,
+    'mctsBatchSize': 1,
     'cpuct': 1,
     'checkpoint': './temp/',
     'numItersForTrainExamplesHistory': 5,
@@ -44,18 +45,26 @@ def decodeBoard(boardJSON):
 
 def decideMove(game,board,curPlayer):
     canonicalBoard = game.getCanonicalForm(board, curPlayer)
-    pi = mcts.getActionProb(canonicalBoard, temp=0,multiprocess=False)
+    # reuse the search below the position reached, dropping the rest of the tree
+    mcts.advance(canonicalBoard)
+    pi = mcts.getActionProb(canonicalBoard, temp=0)
     action = np.random.choice(len(pi), p=pi)
-    onehot_action = np.zeros((4096,))
-    onehot_action[action] = 1
-    piece,(newRow,newCol) = one_hot_to_move(onehot_action,board,curPlayer)
+    piece,(newRow,newCol) = action_to_move(action,board,curPlayer,True)
     return {"piece":{"denomination":piece.denomination,"color":piece.color,"position":piece.position}, "newPosition":[int(newRow),int(newCol)]}
 
 
 async def sendMove(websocket, path):
     boardJSON = await websocket.recv()
     print("< received board state")
-    board = Board(decodeBoard(boardJSON))
+    # Clients may send the JSON board state or, more compactly, a FEN string
+    if boardJSON.lstrip().startswith("{"):
+        board = Board(decodeBoard(boardJSON))
+    elif is_valid_fen(boardJSON):
+        board = Board.from_fen(boardJSON)
+    else:
+        await websocket.send(json.dumps({"error": "invalid FEN string"}))
+        print("> rejected invalid FEN string")
+        return
     curPlayer = board.board["turn"]
 
     move = decideMove(g,board,curPlayer)
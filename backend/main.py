@@ -12,6 +12,7 @@ args = {
     'updateThreshold': 0.55,
     'maxlenOfQueue': 200000,
     'numMCTSSims': 15,
+    'mctsBatchSize': 1,
     'arenaCompare': 10,
     'cpuct': 1,
     'checkpoint': './temp/',
@@ -1,8 +1,15 @@
 import unittest
+import pickle
+import numpy as np
 from chessAI.Piece import Piece
-from chessAI.Move import Move, one_hot_to_move
-from chessAI.Board import Board
+from chessAI.Move import Move, one_hot_to_move, action_to_move, action_to_squares, encode_move, PROMOTION
+from chessAI.Board import Board, START_FEN, is_valid_fen
 from chessAI.Game import Game
+from chessAI.BitBoard import BitBoard, square_index
+from chessAI.perft import perft, divide
+from chessAI.Examples import pack_example, compact_example, pack_board, pack_policy, ExampleSet, BOARD_BYTES
+from chessAI.Epd import read_epd, load_epd
+from chessAI.MCTS import MCTS
 
 class BoardTestCase(unittest.TestCase):
     def setUp(self):
@@ -175,6 +182,18 @@ class TestPieceMoves(BoardTestCase):
         blackPawn8 = self.position1[(2,7)]
         self.assertEqual(set(blackPawn8.moves(self.board1.board)),set([(3,7)]))
 
+    def test_one_hot_copy(self):
+        features = Piece("Pawn",1,(6,0)).one_hot()
+        features[0] = 0
+        self.assertEqual(Piece("Pawn",1,(5,0)).one_hot(),[1,0,0,0,0,0,0,0,0,0,0,0])
+
+    def test_interned(self):
+        rook = Piece("Rook",1,(7,0))
+        self.assertTrue(rook is self.position1[(7,0)])
+        self.assertTrue(pickle.loads(pickle.dumps(rook)) is rook)
+        self.assertFalse(hasattr(rook,"__dict__"))
+        self.assertEqual((rook.code,self.position1[(0,0)].code),(3,9))
+
 class TestMoveMethods(BoardTestCase):
     def __is_same_move(self,move,newMoveTuple):
         piece,newSquare = newMoveTuple
@@ -190,7 +209,45 @@ class TestMoveMethods(BoardTestCase):
         self.assertTrue(self.__is_same_move(self.move3,one_hot_to_move(self.move3.one_hot(),self.board1,1,False)))
         self.assertTrue(self.__is_same_move(self.move4,one_hot_to_move(self.move4.one_hot(),self.board1,-1,False)))
 
+    def test_packed_move(self):
+        self.assertEqual(self.move1.code,64*(5*8+3)+(4*8+2))
+        self.assertEqual(self.move1.action(),np.argmax(self.move1.one_hot()))
+        self.assertEqual(action_to_squares(self.move1.code),((5,3),(4,2)))
+        promotion = Move(Piece("Pawn",1,(1,7)),(0,7))
+        self.assertTrue(promotion.code & PROMOTION)
+        self.assertEqual(promotion.action(),encode_move((1,7),(0,7)))
+        self.assertEqual(action_to_squares(promotion.code),((1,7),(0,7)))
+
+    def test_action_to_move(self):
+        self.assertTrue(self.__is_same_move(self.move2,action_to_move(self.move2.action(),self.board1,-1,False)))
+        # Black's h6-h5 seen from the canonical (flipped) board is h3-h4
+        flipped = Move(Piece("Pawn",1,(5,7)),(4,7))
+        self.assertTrue(self.__is_same_move(self.move2,action_to_move(flipped.action(),self.board1,-1,True)))
+
 class TestBoardMethods(BoardTestCase):
+    def testLegalMovesLeaveBoard(self):
+        # Generating moves does not reorder or change the board, including
+        # king moves and an en passant capture that would expose the king
+        board = Board.from_fen("8/8/8/KPp4r/8/8/8/4k3 w - c6 0 1")
+        squares = list(board.board.keys())
+        moves = set([(move.piece.position,move.newSquare) for move in board.legal_moves(1)])
+        self.assertEqual(list(board.board.keys()),squares)
+        self.assertFalse(((3,1),(2,2)) in moves)
+        self.assertTrue(((3,1),(2,1)) in moves)
+        board = Board.from_fen("8/8/8/K6r/8/8/8/4k3 w - - 0 1")
+        moves = [(move.piece.position,move.newSquare) for move in board.legal_moves(1)]
+        self.assertFalse(((3,0),(3,1)) in moves)
+        self.assertTrue(((3,0),(2,1)) in moves)
+        self.assertEqual(board.board[(3,0)],Piece("King",1,(3,0)))
+        board = Board.from_fen("8/8/8/1KPp3r/8/8/8/4k3 w - d6 0 1")
+        self.assertFalse(((3,2),(2,3)) in [(move.piece.position,move.newSquare) for move in board.legal_moves(1)])
+        board = Board.from_fen("8/8/8/2Pp4/1K6/8/8/4k3 w - d6 0 1")
+        self.assertTrue(((3,2),(2,3)) in [(move.piece.position,move.newSquare) for move in board.legal_moves(1)])
+        squares = list(self.board1.board.keys())
+        self.board1.legal_moves(1)
+        self.board1.legal_moves(-1)
+        self.assertEqual(list(self.board1.board.keys()),squares)
+
     def __equal_pieces(self,piece1,piece2):
         sameDenomination = piece1.denomination == piece2.denomination
         sameColor = piece1.color == piece2.color
@@ -217,10 +274,88 @@ class TestBoardMethods(BoardTestCase):
         self.assertTrue(self.__equal_boards(self.board2,self.board1.execute_move(self.board1,self.position1[(6,0)],(5,0),1)))
         self.assertFalse(self.__equal_boards(self.board2,self.board1.execute_move(self.board1,self.position1[(6,1)],(5,1),1)))
 
+    def test_make_unmake_move(self):
+        original1 = Board(dict(self.position1))
+        original2 = Board(dict(self.position2))
+        # En passant capture removes the passed pawn and is fully restored
+        self.board1.make_move(Move(self.position1[(3,3)],(2,2)))
+        self.assertFalse((3,2) in self.board1.board)
+        self.assertEqual(self.board1.board["turn"],-1)
+        self.board1.unmake_move()
+        self.assertTrue(self.__equal_boards(self.board1,original1))
+        # Castling moves the rook and removes castling rights
+        self.board2.make_move(Move(self.position2[(0,4)],(0,6)))
+        self.assertEqual(self.board2.board[(0,5)].denomination,"Rook")
+        self.assertEqual(self.board2.board["blackCastlingRights"],(False,False))
+        self.board2.unmake_move()
+        self.assertTrue(self.__equal_boards(self.board2,original2))
+
+    def test_make_move_matches_execute_move(self):
+        executed = self.board1.execute_move(self.board1,self.position1[(6,0)],(5,0),1)
+        self.board1.make_move(Move(self.position1[(6,0)],(5,0)))
+        self.assertTrue(self.__equal_boards(executed,self.board1))
+        self.assertTrue(self.__equal_boards(self.board2,self.board1))
+
     def test_legal_moves(self):
         self.assertEqual(len(self.board1.legal_moves(1)),36)
         self.assertEqual(len(self.board2.legal_moves(-1)),31)
 
+    def test_pinned_piece(self):
+        # The knight on c3 is pinned to the king by the bishop on b4
+        pinnedMoves = [move for move in self.board1.legal_moves(1) if move.piece.position == (5,2)]
+        self.assertEqual(pinnedMoves,[])
+
+    def test_check_evasions(self):
+        checkedBoard = self.board2.execute_move(self.board2,self.position2[(4,1)],(5,2),-1)
+        evasions = set([(move.piece.position,move.newSquare) for move in checkedBoard.legal_moves(1)])
+        # Capture the bishop, block on d2 or step the king aside
+        self.assertEqual(evasions,set([((6,1),(5,2)),((5,3),(5,2)),((5,3),(6,3)),((5,4),(6,3)),((7,4),(7,3))]))
+
+    def test_is_attacked(self):
+        self.assertTrue(self.board1.is_attacked((2,2),1))
+        self.assertTrue(self.board1.is_attacked((4,6),-1))
+        self.assertTrue(self.board1.is_attacked((5,0),-1))
+        self.assertTrue(self.board1.is_attacked((5,5),1))
+        self.assertFalse(self.board1.is_attacked((5,5),-1))
+
+    def test_castling_through_pawn_attack(self):
+        castleMove = ((0,4),(0,6))
+        self.assertTrue(castleMove in [(move.piece.position,move.newSquare) for move in self.board2.legal_moves(-1)])
+        self.position2[(1,7)] = Piece("Pawn",1,(1,7))
+        attackedBoard = Board(self.position2)
+        self.assertFalse(castleMove in [(move.piece.position,move.newSquare) for move in attackedBoard.legal_moves(-1)])
+
+    def test_material(self):
+        self.assertEqual(self.board1.material,[8,2,2,2,1,1,8,2,2,2,1,1])
+        # En passant capture of the c-pawn
+        self.board1.make_move(Move(self.position1[(3,3)],(2,2)))
+        self.assertEqual(self.board1.material,Board(dict(self.board1.board)).material)
+        self.assertEqual(self.board1.material_balance(),1)
+        self.board1.unmake_move()
+        self.assertEqual(self.board1.material,[8,2,2,2,1,1,8,2,2,2,1,1])
+        self.assertFalse(self.board1.no_wins())
+        kingsAndKnight = { (0,4): Piece("King",-1,(0,4)), (7,4): Piece("King",1,(7,4)), (5,2): Piece("Knight",1,(5,2))
+                    , "whiteCastlingRights": (False,False), "blackCastlingRights": (False,False)
+                    , "whiteKing": (7,4), "blackKing": (0,4), "enPassant": None
+                    , "recentMoves": [(0,0,0),(1,1,1),(2,2,2),(3,3,3),(4,4,4),(5,5,5)], "turn": 1 }
+        self.assertTrue(Board(kingsAndKnight).no_wins())
+        self.assertEqual(Board(kingsAndKnight).material_balance(),3)
+
+    def test_zobrist_key(self):
+        # Keys kept up by make_move match keys computed from scratch
+        for move in [Move(self.position1[(3,3)],(2,2)), Move(self.position1[(5,4)],(2,7))]:
+            self.board1.make_move(move)
+            self.assertEqual(self.board1.key,Board(dict(self.board1.board)).key)
+        self.board1.unmake_move()
+        self.board1.unmake_move()
+        self.assertEqual(self.board1.key,Board(dict(self.position1)).key)
+        castled = self.board2.execute_move(self.board2,self.position2[(0,4)],(0,6),-1)
+        self.assertEqual(castled.key,Board(dict(castled.board)).key)
+        self.assertNotEqual(castled.key,self.board2.key)
+        rookMoved = self.board2.execute_move(self.board2,self.position2[(0,7)],(0,6),-1)
+        self.assertEqual(rookMoved.key,Board(dict(rookMoved.board)).key)
+        self.assertEqual(self.board1.execute_move(self.board1,self.position1[(6,0)],(5,0),1).key,self.board2.key)
+
     def test_repetition(self):
         testBoard = self.board1.execute_move(self.board1.execute_move(self.board1.execute_move(self.board1.execute_move(self.board1.execute_move(self.board1,
             Piece("Bishop", 1, (5,4)),(6,3),1),
@@ -232,6 +367,13 @@ class TestBoardMethods(BoardTestCase):
         nonrepetitionBoard = self.board1.execute_move(testBoard,Piece("Bishop", -1, (4,1)),(5,2),-1)
         self.assertTrue(repetitionBoard.repetition())
         self.assertFalse(nonrepetitionBoard.repetition())
+        # make_move/ unmake_move keep the history in step
+        self.board1.make_move(Move(self.position1[(5,4)],(6,3)))
+        self.board1.make_move(Move(self.position1[(4,1)],(3,0)))
+        self.assertFalse(self.board1.repetition())
+        self.board1.unmake_move()
+        self.board1.unmake_move()
+        self.assertEqual(self.board1.history,{self.board1.key: 1})
 
 class TestGameMethods(BoardTestCase):
     def __equal_pieces(self,piece1,piece2):
@@ -299,19 +441,475 @@ class TestGameMethods(BoardTestCase):
         self.assertTrue(self.__equal_boards(self.board1,self.game.getCanonicalForm(self.board1,1)))
 
 
+    def testNextState(self):
+        (nextBoard,nextPlayer) = self.game.getNextState(self.board1,1,Move(self.position1[(6,0)],(5,0)).action())
+        self.assertEqual(nextPlayer,-1)
+        self.assertEqual(nextBoard.key,self.board2.key)
+        # Actions of black are given in the canonical frame
+        blackAction = Move(Piece("Bishop",1,(3,1)),(2,2)).action()
+        (nextBoard,nextPlayer) = self.game.getNextState(self.board2,-1,blackAction)
+        self.assertEqual(nextBoard.board[(5,2)].denomination,"Bishop")
+        self.assertEqual(nextBoard.board[(5,2)].color,-1)
+
+    def testNextCanonicalState(self):
+        original1 = Board(dict(self.position1))
+        nextBoard = self.game.getNextCanonicalState(self.board1,Move(self.position1[(6,0)],(5,0)).one_hot())
+        self.assertTrue(self.__equal_boards(self.game.getCanonicalForm(self.board2,-1),nextBoard))
+        self.assertTrue(self.__equal_boards(original1,self.board1))
+
+    def testCanonicalFormCache(self):
+        canonical = self.game.getCanonicalForm(self.board2,-1)
+        self.assertTrue(self.game.getCanonicalForm(self.board2,-1) is canonical)
+        self.assertEqual(canonical.key,Board(dict(canonical.board)).key)
+        self.assertEqual(canonical.key,self.board2.mirrorKey)
+        self.assertEqual(canonical.board[(2,0)],Piece("Pawn",-1,(2,0)))
+        self.assertEqual(canonical.board["turn"],1)
+        self.assertTrue(self.__equal_boards(canonical.mirror(),self.board2))
+        # The cached form is dropped once a move is made
+        self.board2.make_move(self.board2.legal_moves(-1)[0])
+        self.assertFalse(self.game.getCanonicalForm(self.board2,-1) is canonical)
+        self.assertEqual(self.board2.mirrorKey,Board(dict(self.board2.board)).mirrorKey)
+        self.board2.unmake_move()
+        self.assertTrue(self.game.getCanonicalForm(self.board2,-1) is canonical)
+
     def testGameEnded(self):
-        pass
+        # 1. f3 e5 2. g4 Qh4#
+        board = self.game.getInitBoard()
+        for (oldSquare,newSquare) in [((6,5),(5,5)),((1,4),(3,4)),((6,6),(4,6)),((0,3),(4,7))]:
+            self.assertEqual(self.game.getGameEnded(board,1),0)
+            board = board.execute_move(board,board.board[oldSquare],newSquare,board.board["turn"])
+        self.assertTrue(board.in_check())
+        self.assertEqual(self.game.getGameEnded(board,1),-1)
+        self.assertEqual(self.game.getGameEnded(board,-1),1)
+
+    def testDrawByRepetition(self):
+        board = self.game.getInitBoard()
+        shuffle = [((7,6),(5,5)),((0,6),(2,5)),((5,5),(7,6)),((2,5),(0,6))]
+        for (oldSquare,newSquare) in shuffle*2:
+            self.assertEqual(self.game.getGameEnded(board,1),0)
+            board = board.execute_move(board,board.board[oldSquare],newSquare,board.board["turn"])
+        # The initial position has now occurred three times
+        self.assertEqual(self.game.getGameEnded(board,1),1e-12)
+        self.assertEqual(board.halfmoveClock,8)
+        # The canonical form shares the position history
+        self.assertTrue(self.game.getCanonicalForm(board.execute_move(board,board.board[(7,6)],(5,5),1),-1).repetition(3))
+        # A pawn move clears the history and the clock
+        pawnMoved = board.execute_move(board,board.board[(6,4)],(4,4),1)
+        self.assertFalse(pawnMoved.repetition())
+        self.assertEqual(pawnMoved.halfmoveClock,0)
+
+    def testFiftyMoveRule(self):
+        board = self.game.getInitBoard()
+        board.halfmoveClock = 99
+        self.assertEqual(self.game.getGameEnded(board,1),0)
+        board.make_move(Move(board.board[(7,6)],(5,5)))
+        self.assertEqual(self.game.getGameEnded(board,-1),1e-12)
+        board.unmake_move()
+        self.assertEqual(board.halfmoveClock,99)
+        self.assertEqual(self.game.getGameEnded(board,1),0)
+
+    def testDerivedStateCache(self):
+        moves = self.board1.legal_moves(1)
+        self.assertTrue(self.board1.legal_moves(1) is moves)
+        self.board1.make_move(moves[0])
+        self.assertFalse(self.board1.legal_moves(-1) is moves)
+        self.board1.unmake_move()
+        self.assertTrue(self.board1.legal_moves(1) is moves)
 
     def testValidMoves(self):
         self.assertEqual(sum(self.game.getValidMoves(self.board1,1)),36)
 
+    def testValidActions(self):
+        validActions = self.game.getValidActions(self.board1,1)
+        self.assertEqual(validActions.dtype,np.int16)
+        self.assertEqual(validActions.tolist(),np.flatnonzero(self.game.getValidMoves(self.board1,1)).tolist())
+        self.assertTrue(self.move1.action() in validActions)
+
     def testOne_hot(self):
         self.assertEqual(sum(self.game.one_hot(self.board1)),36)
+        # Same layout as concatenating Piece.one_hot over the squares
+        expected = []
+        for i in range(8):
+            for j in range(8):
+                if (i,j) in self.position2:
+                    expected = expected + self.position2[(i,j)].one_hot()
+                else:
+                    expected = expected + [0]*12
+        expected = expected + [1,1,1,1]
+        self.assertEqual(self.game.one_hot(self.board2).tolist(),expected)
+        batch = np.ones((2,772),dtype=np.float32)
+        self.game.one_hot(self.board2,out=batch[1])
+        self.assertEqual(batch[1].tolist(),expected)
+
+    def testOne_hot_batch(self):
+        boards = [self.board1,self.board2,self.game.getInitBoard()]
+        batch = self.game.one_hot_batch(boards)
+        self.assertEqual(batch.shape,(3,772))
+        for (row,board) in zip(batch,boards):
+            self.assertEqual(row.tolist(),self.game.one_hot(board).tolist())
+        out = np.ones((3,772),dtype=np.float32)
+        self.assertTrue(self.game.one_hot_batch(boards,out=out) is out)
+        self.assertEqual(out.tolist(),batch.tolist())
+        self.assertEqual(self.game.one_hot_batch([]).shape,(0,772))
+
+    def testSquareCodes(self):
+        # Kept up to date through castling, en passant, promotion and undo
+        board = Board.from_fen("r3k2r/1P6/8/3pP3/8/8/8/R3K2R w KQkq d6 0 1")
+        for move in list(board.legal_moves(1)):
+            board.make_move(move)
+            self.assertEqual(board.squareCodes.tolist(),Board(dict(board.board)).squareCodes.tolist())
+            mirrored = board.mirror()
+            self.assertEqual(mirrored.squareCodes.tolist(),Board(dict(mirrored.board)).squareCodes.tolist())
+            board.unmake_move()
+            self.assertEqual(board.squareCodes.tolist(),Board(dict(board.board)).squareCodes.tolist())
+        nextBoard = self.game.getNextState(board,1,Move(board.board[(7,4)],(7,6)).action())[0]
+        self.assertEqual(nextBoard.squareCodes.tolist(),Board(dict(nextBoard.board)).squareCodes.tolist())
+        self.assertEqual(board.squareCodes[64:].tolist(),[1,1,1,1])
+
+class TestBitBoard(BoardTestCase):
+    def __move_set(self,moves):
+        return set([(move.piece.denomination,move.piece.position,move.newSquare) for move in moves])
+
+    def test_conversion(self):
+        converted = BitBoard.from_board(self.board1).to_board()
+        self.assertEqual(self.__move_set(converted.legal_moves(1)),self.__move_set(self.board1.legal_moves(1)))
+        self.assertEqual(converted.board["enPassant"],(2,2))
+        self.assertEqual(converted.board["blackKing"],(0,4))
+
+    def test_legal_moves(self):
+        bitBoard1 = BitBoard.from_board(self.board1)
+        bitBoard2 = BitBoard.from_board(self.board2)
+        self.assertEqual(self.__move_set(bitBoard1.legal_moves(1)),self.__move_set(self.board1.legal_moves(1)))
+        self.assertEqual(self.__move_set(bitBoard2.legal_moves(-1)),self.__move_set(self.board2.legal_moves(-1)))
+
+    def test_execute_move(self):
+        bitBoard1 = BitBoard.from_board(self.board1)
+        bitBoard2 = bitBoard1.execute_move(bitBoard1,self.position1[(6,0)],(5,0),1)
+        self.assertEqual(bitBoard2.pieces,BitBoard.from_board(self.board2).pieces)
+        self.assertEqual(bitBoard2.turn,-1)
+        self.assertEqual(bitBoard2.enPassant,None)
+
+    def test_check(self):
+        bitBoard2 = BitBoard.from_board(self.board2)
+        self.assertFalse(bitBoard2.is_in_check(bitBoard2,(7,4),1))
+        checked = bitBoard2.execute_move(bitBoard2,self.position2[(4,1)],(5,2),-1)
+        self.assertTrue(checked.is_in_check(checked,(7,4),1))
+
+    def test_flip(self):
+        bitBoard2 = BitBoard.from_board(self.board2)
+        flipped = BitBoard.from_board(Game().getCanonicalForm(self.board2,-1))
+        self.assertEqual(bitBoard2.flip().pieces,flipped.pieces)
+        self.assertEqual(bitBoard2.flip().castling,flipped.castling)
+        self.assertEqual(bitBoard2.flip().flip().pieces,bitBoard2.pieces)
+        self.assertEqual(BitBoard.from_board(self.board1).flip().enPassant,square_index((5,2)))
+
+    def test_game_methods(self):
+        # A game played through Game on a BitBoard follows the Board game
+        board = self.game.getInitBoard()
+        bitBoard = BitBoard.from_board(board)
+        self.assertEqual(self.game.positionKey(bitBoard),self.game.positionKey(board))
+        player = 1
+        rng = np.random.RandomState(7)
+        for ply in range(80):
+            canonicalBoard = self.game.getCanonicalForm(board,player)
+            canonicalBitBoard = self.game.getCanonicalForm(bitBoard,player)
+            validActions = self.game.getValidActions(canonicalBoard,1)
+            self.assertEqual(self.game.getValidActions(canonicalBitBoard,1).tolist(),validActions.tolist())
+            self.assertEqual(self.game.one_hot(canonicalBitBoard).tolist(),self.game.one_hot(canonicalBoard).tolist())
+            self.assertEqual(self.game.positionKey(canonicalBitBoard),self.game.positionKey(canonicalBoard))
+            self.assertEqual(self.game.getGameEnded(bitBoard,player),self.game.getGameEnded(board,player))
+            if self.game.getGameEnded(board,player) != 0:
+                break
+            action = validActions[rng.randint(len(validActions))]
+            nextBitBoard = self.game.getNextCanonicalState(canonicalBitBoard,action)
+            self.assertEqual(nextBitBoard.to_fen(),self.game.getNextCanonicalState(canonicalBoard,action).to_fen())
+            (board,nextPlayer) = self.game.getNextState(board,player,action)
+            (bitBoard,player) = self.game.getNextState(bitBoard,player,action)
+            self.assertEqual(bitBoard.to_fen(),board.to_fen())
+        self.assertEqual(bitBoard.to_board().history,board.history)
+        self.assertEqual(self.game.one_hot_batch([bitBoard,board]).tolist(),[self.game.one_hot(board).tolist()]*2)
+
+    def test_backend(self):
+        game = Game(BitBoard)
+        initBoard = game.getInitBoard()
+        self.assertTrue(isinstance(initBoard,BitBoard))
+        self.assertEqual(initBoard.to_fen(),START_FEN)
+        self.assertEqual(game.getValidActions(initBoard,1).tolist(),self.game.getValidActions(self.game.getInitBoard(),1).tolist())
+        bitBoard1 = BitBoard.from_board(self.board1)
+        self.assertEqual(bitBoard1.material,self.board1.material)
+        self.assertEqual(bitBoard1.material_balance(),self.board1.material_balance())
+        for square in [(2,2),(4,4),(0,5),(7,3)]:
+            for color in (1,-1):
+                self.assertEqual(bitBoard1.is_attacked(square,color),self.board1.is_attacked(square,color))
+
+    def test_mcts(self):
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 50, 'cpuct': 1})
+        bitBoardMcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 50, 'cpuct': 1})
+        self.assertEqual(bitBoardMcts.getActionProb(BitBoard.from_board(self.board1),temp=1),mcts.getActionProb(self.board1,temp=1))
+
+    def test_arena_check(self):
+        # Arena passes the board dict, as for Board.is_in_check
+        bitBoard2 = BitBoard.from_board(self.board2)
+        checked = bitBoard2.execute_move(bitBoard2,self.position2[(4,1)],(5,2),-1)
+        self.assertTrue(checked.is_in_check(checked.board,checked.board["whiteKing"],1))
+        self.assertFalse(checked.is_in_check(checked.board,checked.board["blackKing"],-1))
+        self.assertTrue(checked.in_check())
+        self.assertEqual(checked.board[(5,2)],Piece("Bishop",-1,(5,2)))
+        self.assertFalse((4,1) in checked.board)
+
+    def test_draws(self):
+        bitBoard = BitBoard.from_fen("4k3/8/8/8/8/8/8/R3K3 w - - 0 1")
+        shuffle = [((7,0),(6,0)),((0,4),(0,3)),((6,0),(7,0)),((0,3),(0,4))]
+        for times in range(2):
+            for (oldSquare,newSquare) in shuffle:
+                self.assertEqual(bitBoard.outcome(),0)
+                bitBoard.make_move(Move(bitBoard.board[oldSquare],newSquare))
+        self.assertTrue(bitBoard.repetition(3))
+        self.assertEqual(self.game.getGameEnded(bitBoard,1),1e-12)
+        self.assertEqual(self.game.getPositionEnded(bitBoard,1),0)
+        bitBoard.unmake_move()
+        self.assertEqual(bitBoard.outcome(),0)
+        self.assertEqual(self.game.getGameEnded(BitBoard.from_fen("4k3/8/8/8/8/8/8/R3K3 w - - 100 1"),1),1e-12)
+
+class TestPerft(BoardTestCase):
+    def test_initial_position(self):
+        initBoard = self.game.getInitBoard()
+        self.assertEqual([perft(initBoard,depth) for depth in range(4)],[1,20,400,8902])
+        self.assertEqual(perft(BitBoard.from_board(initBoard),3),8902)
+
+    def test_divide(self):
+        counts = divide(self.board1,2)
+        self.assertEqual(len(counts),36)
+        self.assertEqual(sum([nodes for (move,nodes) in counts]),perft(self.board1,2))
+        self.assertEqual(perft(self.board1,2),perft(BitBoard.from_board(self.board1),2))
+
+    def test_fen_positions(self):
+        kiwipete = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+        self.assertEqual([perft(Board.from_fen(kiwipete),depth) for depth in range(1,3)],[48,2039])
+        self.assertEqual(perft(BitBoard.from_fen(kiwipete),2),2039)
+        self.assertEqual(perft(Board.from_fen("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),3),2812)
+
+class TestFen(BoardTestCase):
+    def test_round_trip(self):
+        self.assertEqual(Board.from_fen(START_FEN).key,self.game.getInitBoard().key)
+        self.assertEqual(self.game.getInitBoard().to_fen(),START_FEN)
+        fen = "rnbqkbnr/pp1ppppp/8/8/1b1pP3/2N1B3/PPPQ1PPP/R3K2R b KQkq e3 0 1"
+        board = Board.from_fen(fen)
+        self.assertEqual(board.to_fen(),fen)
+        self.assertEqual(board.board["enPassant"],(5,4))
+        self.assertEqual(board.board["blackKing"],(0,4))
+        self.assertEqual(BitBoard.from_fen(fen).pieces,BitBoard.from_board(board).pieces)
+        self.assertEqual(BitBoard.from_fen(fen).to_fen(),fen)
+        self.assertEqual(Board.from_fen("4k3/8/8/8/8/8/8/4K2R w K - 37 60").halfmoveClock,37)
+        self.assertEqual(Board.from_fen("4k3/8/8/8/8/8/8/4K2R w K - 37 60").to_fen(),"4k3/8/8/8/8/8/8/4K2R w K - 37 60")
+        self.assertEqual(BitBoard.from_fen("4k3/8/8/8/8/8/8/4K2R w K - 37 60").to_fen(),"4k3/8/8/8/8/8/8/4K2R w K - 37 60")
+
+    def test_fullmove_number(self):
+        for boardClass in (Board,BitBoard):
+            board = boardClass.from_fen("4k3/8/8/8/8/8/8/4K2R w K - 3 12")
+            board.make_move(Move(board.board[(7,7)],(6,7)))
+            self.assertEqual(board.to_fen(),"4k3/8/8/8/8/8/7R/4K3 b - - 4 12")
+            board.make_move(Move(board.board[(0,4)],(0,3)))
+            self.assertEqual(board.fullmoveNumber,13)
+            nextBoard = board.execute_move(board,board.board[(6,7)],(5,7),1)
+            self.assertEqual(nextBoard.to_fen(),"3k4/8/8/8/8/7R/8/4K3 b - - 6 13")
+            board.unmake_move()
+            board.unmake_move()
+            self.assertEqual(board.to_fen(),"4k3/8/8/8/8/8/8/4K2R w K - 3 12")
+        self.assertEqual(BitBoard.from_fen("4k3/8/8/8/8/8/8/4K2R b K - 3 12").to_board().to_fen(),"4k3/8/8/8/8/8/8/4K2R b K - 3 12")
+
+    def test_is_valid_fen(self):
+        self.assertTrue(is_valid_fen(START_FEN))
+        self.assertTrue(is_valid_fen("4k3/8/8/8/8/8/8/4K2R w K -"))
+        self.assertTrue(is_valid_fen("rnbqkbnr/pp1ppppp/8/8/1b1pP3/2N1B3/PPPQ1PPP/R3K2R b KQkq e3 0 1"))
+        for fen in ("", "hello", "4k3/8/8/8/8/8/8/4K2R", "4k3/8/8/8/8/8/4K2R w K - 0 1", "4k3/9/8/8/8/8/8/4K2R w K - 0 1",
+                "4k3/8/8/8/8/8/8/4K2X w K - 0 1", "8/8/8/8/8/8/8/4K2R w K - 0 1", "4k3/8/8/8/8/8/8/4K2R x K - 0 1",
+                "4k3/8/8/8/8/8/8/4K2R w KX - 0 1", "4k3/8/8/8/8/8/8/4K2R w K e4 0 1", "4k3/8/8/8/8/8/8/4K2R w K - -1 1",
+                "4k3/8/8/8/8/8/8/4K2R w K - 0 1 2"):
+            self.assertFalse(is_valid_fen(fen),fen)
+
+    def test_to_fen(self):
+        self.assertEqual(self.board1.to_fen(),"rnbqk2r/pp1p1pp1/5n1p/2pPp3/1b6/2NQB3/PPP1PPPP/R3KBNR w KQkq c6 0 1")
+        self.assertEqual(self.board2.to_fen(),"rnbqk2r/pp1p1pp1/5n1p/2pPp3/1b6/P1NQB3/1PP1PPPP/R3KBNR b KQkq - 0 1")
+
+    def test_read_epd(self):
+        lines = [START_FEN + " ;D1 20 ;D2 400\n"
+            , "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - bm e2a6; id \"kiwipete\";\n"
+            , "\n"]
+        records = list(read_epd(lines))
+        self.assertEqual(records[0],(START_FEN,{"D1": "20", "D2": "400"}))
+        self.assertEqual(records[1][1],{"bm": "e2a6", "id": "kiwipete"})
+        self.assertEqual(Board.from_fen(records[1][0]).to_fen(),records[1][0])
+
+    def test_load_epd(self):
+        boards = [self.board1,self.board2,self.game.getInitBoard()]
+        packed = load_epd([board.to_fen() for board in boards],chunkSize=2)
+        self.assertEqual(packed.shape,(3,BOARD_BYTES))
+        for (board,row) in zip(boards,packed):
+            canonicalBoard = self.game.getCanonicalForm(board,board.board["turn"])
+            self.assertEqual(row.tolist(),pack_board(self.game.one_hot(canonicalBoard)).tolist())
+
+class UniformNet():
+    """Stands in for NeuralNet: a uniform policy and a value of 0"""
+    def predict(self,board):
+        return np.ones((4096,),dtype=np.float32)/4096, 0.0
+
+    def predict_batch(self,boards):
+        return np.ones((len(boards),4096),dtype=np.float32)/4096, np.zeros((len(boards),))
+
+class UnsyncedNet():
+    """A net Coach does not load checkpoints into, which MCTS must not query"""
+    def predict(self,board):
+        raise AssertionError("leaf evaluated with an unsynced net")
+
+    def predict_batch(self,boards):
+        raise AssertionError("leaf evaluated with an unsynced net")
+
+class TestMCTS(BoardTestCase):
+    def test_synced_net_only(self):
+        nnets = [UniformNet()] + [UnsyncedNet() for i in range(7)]
+        for batchSize in (1,8):
+            mcts = MCTS(self.game,nnets,{'numMCTSSims': 40, 'cpuct': 1, 'mctsBatchSize': batchSize})
+            self.assertAlmostEqual(sum(mcts.getActionProb(self.board1,temp=1)),1)
+
+    def __fools_mate_board(self):
+        # 1. f3 e5 2. g4, black mates with Qh4
+        board = self.game.getInitBoard()
+        for (oldSquare,newSquare) in [((6,5),(5,5)),((1,4),(3,4)),((6,6),(4,6))]:
+            board = board.execute_move(board,board.board[oldSquare],newSquare,board.board["turn"])
+        return board
+
+    def test_policy(self):
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 50, 'cpuct': 1})
+        pi = np.array(mcts.getActionProb(self.board1,temp=1))
+        self.assertAlmostEqual(pi.sum(),1)
+        self.assertTrue(set(np.flatnonzero(pi)) <= set(self.game.getValidActions(self.board1,1).tolist()))
+        root = mcts.store.node(self.game.positionKey(self.board1))
+        self.assertEqual(mcts.store.childVisits[mcts.store.children(root)].sum(),49)
+
+    def test_finds_mate(self):
+        board = self.__fools_mate_board()
+        canonicalBoard = self.game.getCanonicalForm(board,-1)
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 100, 'cpuct': 1})
+        action = int(np.argmax(mcts.getActionProb(canonicalBoard,temp=0)))
+        (piece,newSquare) = action_to_move(action,board,-1,True)
+        self.assertEqual((piece.position,newSquare),((0,3),(4,7)))
+
+    def test_batched_search(self):
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 50, 'cpuct': 1, 'mctsBatchSize': 8})
+        pi = np.array(mcts.getActionProb(self.board1,temp=1))
+        self.assertAlmostEqual(pi.sum(),1)
+        store = mcts.store
+        root = store.node(self.game.positionKey(self.board1))
+        # Every simulation after the one expanding the root ends as one
+        # visit, and no virtual loss is left in the values
+        self.assertEqual(store.childVisits[store.children(root)].sum(),49)
+        self.assertEqual(store.valueSum[:store.numChildren].tolist(),[0]*store.numChildren)
+        board = self.__fools_mate_board()
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 96, 'cpuct': 1, 'mctsBatchSize': 8})
+        action = int(np.argmax(mcts.getActionProb(self.game.getCanonicalForm(board,-1),temp=0)))
+        self.assertEqual(action_to_move(action,board,-1,True)[1],(4,7))
+
+    def test_history_draws_not_cached(self):
+        # Every move from the root is a draw by the fifty-move rule, but the
+        # positions they reach are not drawn when reached with a fresh clock
+        root = Board.from_fen("4k3/8/8/8/8/8/8/R3K3 w - - 99 1")
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 30, 'cpuct': 1})
+        mcts.getActionProb(root,temp=1)
+        nextBoard = self.game.getNextCanonicalState(root,self.game.getValidActions(root,1)[0])
+        self.assertEqual(self.game.getGameEnded(nextBoard,1),1e-12)
+        fields = nextBoard.to_fen().split()
+        freshBoard = Board.from_fen(" ".join(fields[:4] + ["0","1"]))
+        self.assertEqual(self.game.positionKey(freshBoard),self.game.positionKey(nextBoard))
+        mcts.advance(freshBoard)
+        pi = np.array(mcts.getActionProb(freshBoard,temp=1))
+        self.assertAlmostEqual(pi.sum(),1)
+        action = int(np.argmax(mcts.getActionProb(freshBoard,temp=0)))
+        self.assertTrue(action in self.game.getValidActions(freshBoard,1).tolist())
+
+    def test_advance(self):
+        mcts = MCTS(self.game,[UniformNet()],{'numMCTSSims': 200, 'cpuct': 1})
+        pi = mcts.getActionProb(self.board1,temp=1)
+        store = mcts.store
+        action = int(np.argmax(pi))
+        nextBoard = self.game.getNextCanonicalState(self.board1,action)
+        child = store.node(self.game.positionKey(nextBoard))
+        childVisits = store.childVisits[store.children(child)].tolist()
+        numNodes = store.numNodes
+        mcts.advance(nextBoard)
+        root = store.node(self.game.positionKey(nextBoard))
+        self.assertEqual(root,0)
+        self.assertEqual(store.childVisits[store.children(root)].tolist(),childVisits)
+        self.assertEqual(store.numNodes,1+sum(childVisits))
+        self.assertTrue(store.numNodes < numNodes)
+        self.assertEqual(store.node(self.game.positionKey(self.board1)),None)
+        # Searching on continues from the kept statistics
+        mcts.getActionProb(nextBoard,temp=1)
+        self.assertEqual(store.childVisits[store.children(root)].sum(),sum(childVisits)+200)
+        mcts.advance(self.board2)
+        self.assertEqual(store.numNodes,0)
+
+class TestExamples(BoardTestCase):
+    def test_round_trip(self):
+        pi = np.zeros((4096,))
+        pi[self.move1.action()] = 0.75
+        pi[self.move3.action()] = 0.25
+        oneHots = [self.game.one_hot(self.board1),self.game.one_hot(self.board2)]
+        examples = [pack_example(oneHots[0],pi,1), pack_example(oneHots[1],np.ones((4096,))/4096,-1)]
+        self.assertEqual(examples[0][0].nbytes,BOARD_BYTES)
+        self.assertEqual(len(examples[0][1]),2)
+        (boards,targets) = ExampleSet.from_examples(examples).expand()
+        self.assertEqual(boards.tolist(),np.stack(oneHots).tolist())
+        self.assertEqual(targets.shape,(2,4097))
+        self.assertEqual(targets[:,0].tolist(),[1,-1])
+        self.assertEqual(targets[0,1:].tolist(),pi.tolist())
+        self.assertAlmostEqual(float(targets[1,1:].sum()),1,places=3)
+
+    def test_compact_dense_example(self):
+        pi = [0]*4096
+        pi[self.move1.action()] = 1
+        example = compact_example((self.game.one_hot(self.board1).tolist(),pi,1e-12))
+        self.assertTrue(compact_example(example) is example)
+        (boards,targets) = ExampleSet.from_examples([example]).expand()
+        self.assertEqual(boards[0].tolist(),self.game.one_hot(self.board1).tolist())
+        self.assertEqual(targets[0,1+self.move1.action()],1)
+
+    def test_example_set(self):
+        boards = [self.board1,self.board2,self.game.getInitBoard()]
+        pis = np.zeros((3,4096))
+        pis[0,[self.move1.action(),self.move3.action()]] = 0.5
+        pis[1,self.move2.action()] = 1
+        pis[2,:] = 1/4096.
+        examples = ExampleSet.from_arrays(np.packbits(self.game.one_hot_batch(boards),axis=1),[pack_policy(pi) for pi in pis],[1,-1,1e-12])
+        self.assertEqual(examples.records["board"].shape,(3,BOARD_BYTES))
+        self.assertEqual(len(examples.policies),4099)
+        (boards,targets) = examples.expand()
+        self.assertEqual(boards.tolist(),self.game.one_hot_batch([self.board1,self.board2,self.game.getInitBoard()]).tolist())
+        self.assertEqual(targets[:2,1:].tolist(),pis[:2].tolist())
+        # Permuted and sliced sets share the policies of the records they keep
+        shuffled = examples[np.array([2,0,1])][1:]
+        self.assertTrue(shuffled.policies is examples.policies)
+        (shuffledBoards,shuffledTargets) = shuffled.expand()
+        self.assertEqual(shuffledTargets.tolist(),targets[:2].tolist())
+        # Concatenating packs the kept policies contiguously
+        window = ExampleSet.concatenate([examples,shuffled],last=3)
+        self.assertEqual(len(window),3)
+        self.assertEqual(len(window.policies),4096+3)
+        self.assertEqual(window.expand()[1].tolist(),np.concatenate([targets[2:],targets[:2]]).tolist())
+        self.assertEqual(len(ExampleSet.concatenate([])),0)
+        self.assertEqual(ExampleSet.from_examples([]).expand()[1].shape,(0,4097))
+        copy = pickle.loads(pickle.dumps(window))
+        self.assertEqual(copy.expand()[1].tolist(),window.expand()[1].tolist())
 
 if __name__ == '__main__':
     pieceSuite = unittest.TestLoader().loadTestsFromTestCase(TestPieceMoves)
     moveSuite = unittest.TestLoader().loadTestsFromTestCase(TestMoveMethods)
     boardSuite = unittest.TestLoader().loadTestsFromTestCase(TestBoardMethods)
     gameSuite = unittest.TestLoader().loadTestsFromTestCase(TestGameMethods)
-    allTests = unittest.TestSuite([pieceSuite, moveSuite,boardSuite,gameSuite])
+    bitBoardSuite = unittest.TestLoader().loadTestsFromTestCase(TestBitBoard)
+    perftSuite = unittest.TestLoader().loadTestsFromTestCase(TestPerft)
+    fenSuite = unittest.TestLoader().loadTestsFromTestCase(TestFen)
+    mctsSuite = unittest.TestLoader().loadTestsFromTestCase(TestMCTS)
+    examplesSuite = unittest.TestLoader().loadTestsFromTestCase(TestExamples)
+    allTests = unittest.TestSuite([pieceSuite, moveSuite,boardSuite,gameSuite,bitBoardSuite,perftSuite,fenSuite,mctsSuite,examplesSuite])
     unittest.TextTestRunner(verbosity=2).run(allTests)